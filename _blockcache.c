@@ -0,0 +1,98 @@
+/*
+ * _blockcache.c - optional C accelerator for blockcache.py.
+ *
+ * Exposes find_interval(keys, lefts, rights, bbl), the enclosing-BBL
+ * lookup that runs once per executed basic block while a trace is
+ * ingested. The arrays are the lazily-sorted array('L') columns kept
+ * by BlockCache; the search runs entirely in C over their buffers,
+ * assuming 8-byte items. blockcache.py only imports this kernel when
+ * array('L').itemsize is 8, and keeps the bisect fallback elsewhere.
+ *
+ * Build with: python setup.py build_ext --inplace
+ * blockcache.py falls back to a bisect-based version when this
+ * module is not built.
+ */
+
+#include <Python.h>
+
+static int
+as_u64_buffer(PyObject *obj, const unsigned long long **out, Py_ssize_t *n)
+{
+    const void *buf;
+    Py_ssize_t len;
+
+    if (PyObject_AsReadBuffer(obj, &buf, &len) < 0)
+        return -1;
+    *out = (const unsigned long long *)buf;
+    *n = len / (Py_ssize_t)sizeof(unsigned long long);
+    return 0;
+}
+
+static PyObject *
+find_interval(PyObject *self, PyObject *args)
+{
+    PyObject *keys_obj, *lefts_obj, *rights_obj;
+    unsigned PY_LONG_LONG bbl;
+    const unsigned long long *keys, *lefts, *rights, *base, *mid;
+    Py_ssize_t n, nl, nr, size, half, lo;
+
+    if (!PyArg_ParseTuple(args, "OOOK:find_interval",
+                          &keys_obj, &lefts_obj, &rights_obj, &bbl))
+        return NULL;
+
+    if (as_u64_buffer(keys_obj, &keys, &n) < 0 ||
+            as_u64_buffer(lefts_obj, &lefts, &nl) < 0 ||
+            as_u64_buffer(rights_obj, &rights, &nr) < 0)
+        return NULL;
+
+    if (nl != n || nr != n) {
+        PyErr_SetString(PyExc_ValueError,
+                        "key and interval arrays differ in length");
+        return NULL;
+    }
+
+    if (n == 0)
+        Py_RETURN_NONE;
+
+    /*
+     * Branchless binary search for the last start address <= bbl.
+     * The conditional assignment compiles to a cmov, so the loop
+     * carries no unpredictable branch, and both possible next
+     * midpoints are prefetched while the current compare retires.
+     */
+    base = keys;
+    size = n;
+    while (size > 1) {
+        half = size >> 1;
+        mid = base + half;
+#if defined(__GNUC__) || defined(__clang__)
+        __builtin_prefetch(base + (half >> 1));
+        __builtin_prefetch(mid + (half >> 1));
+#endif
+        base = (*mid <= bbl) ? mid : base;
+        size -= half;
+    }
+
+    lo = base - keys;
+    if (keys[lo] > bbl)
+        Py_RETURN_NONE;
+
+    if (lefts[lo] < bbl && rights[lo] > bbl)
+        return Py_BuildValue("(KK)",
+                             (unsigned PY_LONG_LONG)lefts[lo],
+                             (unsigned PY_LONG_LONG)rights[lo]);
+
+    Py_RETURN_NONE;
+}
+
+static PyMethodDef blockcache_methods[] = {
+    { "find_interval", find_interval, METH_VARARGS,
+      "find_interval(keys, lefts, rights, bbl) -> (left, right) or None" },
+    { NULL, NULL, 0, NULL }
+};
+
+PyMODINIT_FUNC
+init_blockcache(void)
+{
+    Py_InitModule("_blockcache", blockcache_methods);
+}
@@ -17,6 +17,11 @@ import subprocess
 import threading
 import ctypes
 import random
+import heapq
+import itertools
+
+_IS_LINUX = platform.system() == 'Linux'
+_IS_WINDOWS = platform.system() == 'Windows'
 
 EVENT_ALL_ACCESS = 0x1F0003
 EVENT_MODIFY_STATE = 0x0002
@@ -24,6 +29,59 @@ EVENT_MODIFY_STATE = 0x0002
 NMPWAIT_USE_DEFAULT_WAIT = 0x0
 NMPWAIT_WAIT_FOREVER = 0xFFFFFFFF
 
+# All runner alarms are serviced by one shared daemon thread waiting
+# on a heap of (deadline, seq, entry) items. Spawning a fresh
+# threading.Timer thread per PIN launch costs a kernel thread and
+# stack per fuzz iteration; pushing onto the heap does not.
+# One /dev/null fd for the whole module; opening and closing it per
+# PIN launch costs two syscalls per fuzz iteration for no benefit.
+_DEVNULL_FD = os.open(os.devnull, os.O_WRONLY)
+
+_TIMER_HEAP = []
+_TIMER_LOCK = threading.Lock()
+_TIMER_WAKE = threading.Event()
+_TIMER_SEQ = itertools.count()
+_TIMER_THREAD = None
+
+def _timer_loop():
+    '''
+        services every pending alarm from the shared daemon thread.
+    '''
+    while True:
+        with _TIMER_LOCK:
+            if _TIMER_HEAP:
+                timeout = _TIMER_HEAP[0][0] - time.time()
+            else:
+                timeout = None
+        if timeout is None or timeout > 0.0:
+            _TIMER_WAKE.wait(timeout)
+            _TIMER_WAKE.clear()
+            continue
+        with _TIMER_LOCK:
+            _, _, entry = heapq.heappop(_TIMER_HEAP)
+        if not entry[0]:
+            entry[1]()
+
+def _set_timer(seconds, callback):
+    '''
+        schedules `callback' to fire after `seconds' seconds. Returns
+        an entry whose first element may be set to True in order to
+        cancel the alarm.
+    '''
+    global _TIMER_THREAD
+    entry = [False, callback]
+    with _TIMER_LOCK:
+        # the thread does not survive a fork: pool workers inherit the
+        # parent's non-None global, so test liveness, not existence
+        if _TIMER_THREAD is None or not _TIMER_THREAD.is_alive():
+            _TIMER_THREAD = threading.Thread(target=_timer_loop)
+            _TIMER_THREAD.daemon = True
+            _TIMER_THREAD.start()
+        heapq.heappush(_TIMER_HEAP,
+                       (time.time() + seconds, next(_TIMER_SEQ), entry))
+    _TIMER_WAKE.set()
+    return entry
+
 class PinRunner(object):
     '''
         Base PIN driver class. It provides a generic interface
@@ -31,18 +89,20 @@ class PinRunner(object):
         binary under PIN's monitoring and the injection of any pintool
         in the process.
     '''
-    pintool = None
-    cmd_template = None
-    process = None
-    timeout = None
-    event_name = None
-    timer = None
+    __slots__ = (
+            'pintool', 'cmd_template', 'process',
+            'timeout', 'event_name', 'timer'
+            )
 
     def __init__(self, timeout=20):
         self.timeout = timeout
-        if platform.system() == 'Linux':
+        self.process = None
+        self.event_name = None
+        self.timer = None
+        self.cmd_template = None
+        if _IS_LINUX:
             self.cmd_template = 'pin -t %s %s'
-        elif platform.system() == 'Windows':
+        elif _IS_WINDOWS:
             self.cmd_template = 'pin.exe -t %s %s'
 
 
@@ -54,9 +114,9 @@ class PinRunner(object):
         if self.process.poll() != None:
             return
         try:
-            if platform.system() == 'Linux':
+            if _IS_LINUX:
                 self.process.send_signal(signal.SIGUSR2)
-            elif platform.system() == 'Windows':
+            elif _IS_WINDOWS:
                 event_object = ctypes.windll.kernel32.OpenEventA(
                                     EVENT_ALL_ACCESS, False, self.event_name)
 
@@ -66,16 +126,16 @@ class PinRunner(object):
 
     def set_alarm(self, seconds=None):
         '''
-            sets a therad timer that calls the handler() function.
+            schedules the handler() function on the shared timer
+            thread, cancelling any alarm that is still pending.
         '''
         if seconds == None:
             return
 
         if self.timer != None:
-            self.timer.cancel()
+            self.timer[0] = True
 
-        self.timer = threading.Timer(float(seconds), self.handler)
-        self.timer.start()
+        self.timer = _set_timer(float(seconds), self.handler)
 
     def craft_command(self, pintool, arguments=''):
         '''
@@ -91,11 +151,11 @@ class PinRunner(object):
                     % pintool
                     )
         cmd = None
-        if platform.system() == 'Linux':
+        if _IS_LINUX:
             cmd = shlex.split(
                 self.cmd_template % (pintool, arguments)
                 )
-        elif platform.system() == 'Windows':
+        elif _IS_WINDOWS:
             cmd = self.cmd_template % (pintool, arguments)
         return cmd
 
@@ -104,11 +164,8 @@ class PinRunner(object):
             runs the user-provided pintool with a user-provided
             argument list.
         '''
-        pintool_args = None
-        if args and type(args) == tuple:
-            pintool_args = ' '.join(args)
-        else:
-            pintool_args = ''
+        # *args is always a tuple, and joining an empty one yields ''
+        pintool_args = ' '.join(args)
         # craft command string
         cmd = self.craft_command(pintool, pintool_args)
         # call pin with
@@ -116,10 +173,9 @@ class PinRunner(object):
         try:
             self.set_alarm(self.timeout)
 
-            with open(os.devnull, 'w') as nullfp:
-                print 'Calling: %s' % cmd
-                self.process = subprocess.Popen(cmd,
-                                    stdout=nullfp, stderr=nullfp)
+            print 'Calling: %s' % cmd
+            self.process = subprocess.Popen(cmd,
+                                stdout=_DEVNULL_FD, stderr=_DEVNULL_FD)
 
             ### self.process.wait()
 
@@ -133,13 +189,30 @@ class Coverage(PinRunner):
         It makes use of OS provided pipes and events to collect
         the execution information as quickly as possible.
     '''
+    __slots__ = ('_wl_id', '_wl_joined')
+
     def __init__(self,
             pintool='analyzer/coverage/obj-intel64/coverage.so',
             timeout=20
             ):
         self.pintool = os.path.abspath(pintool)
+        self._wl_id = None
+        self._wl_joined = ''
         super(Coverage, self).__init__(timeout)
 
+    def _quote_whitelist(self, whitelist):
+        '''
+            quotes and joins the whitelisted image names once per
+            whitelist object; the configured whitelist never changes
+            between runs, so the joined string is memoized.
+        '''
+        if id(whitelist) != self._wl_id:
+            self._wl_joined = ' -wht '.join(
+                    '"%s"' % os.path.basename(image) for image in whitelist
+                    )
+            self._wl_id = id(whitelist)
+        return self._wl_joined
+
     def _run(self, execmd, output, whitelist):
         '''
             execmd is the command string to run
@@ -148,18 +221,16 @@ class Coverage(PinRunner):
         # if os.path.exists(output):
         #    os.remove(output)
 
-        quoted_whilelist = []
-        for image in whitelist:
-            quoted_whilelist.append('\"%s\"' % os.path.basename(image))
+        quoted = self._quote_whitelist(whitelist)
 
         # print '[+] Running pintool...'
-        if platform.system() == 'Linux':
+        if _IS_LINUX:
             return super(Coverage, self).run(
                     self.pintool,
                     '-o %s -wht %s -- %s'
-                    % (output, ' -wht '.join(quoted_whilelist), execmd)
+                    % (output, quoted, execmd)
                     )
-        elif platform.system() == 'Windows':
+        elif _IS_WINDOWS:
             self.event_name = 'Global\\event%s' % str(
                     random.randint(0, 0xFFFFFFFFFFFFFFFF)
                     )
@@ -169,27 +240,28 @@ class Coverage(PinRunner):
                     % (
                         output,
                         self.event_name,
-                        ' -wht '.join(quoted_whilelist),
+                        quoted,
                         execmd
                         )
                 )
 
     def _pre_run(self, output):
-        if platform.system() == 'Linux':
+        if _IS_LINUX:
             os.mkfifo(output)
 
     def _post_run(self, output):
-        if platform.system() == 'Windows':
-            ready = 0
-            while not ready:
-                ready = ctypes.windll.kernel32.WaitNamedPipeA(
-                        output,
-                        NMPWAIT_USE_DEFAULT_WAIT
-                    )
+        if _IS_WINDOWS:
+            # NMPWAIT_WAIT_FOREVER parks the caller in the kernel until
+            # the pintool connects -- one blocking syscall instead of a
+            # busy loop waking up every default-timeout period.
+            ctypes.windll.kernel32.WaitNamedPipeA(
+                    output,
+                    NMPWAIT_WAIT_FOREVER
+                )
 
     def run(self, execmd, output='output.dmp', whitelist=[]):
         basename_output = output
-        if platform.system() == 'Windows':
+        if _IS_WINDOWS:
             output = '\\\\.\\pipe\\%s' % basename_output
         self._pre_run(output)
         self._run(execmd, basename_output, whitelist)
@@ -1,31 +1,74 @@
 '''
     blockcache.py provides a uniform API for Choronzon to
-    store and correlate execution traces. It makes use of an
-    external dependency/module called sortedcontainers.
+    store and correlate execution traces.
 '''
 
-import sortedcontainers as sc
+import array
+import bisect
 
-class BlockCache(object):
+def _py_find_interval(keys, lefts, rights, bbl):
     '''
-        Basic block cache implementation. It is based on a
-        sorted dictionary.
+        pure Python fallback for the enclosing-interval lookup:
+        bisect the sorted start addresses and test whether the
+        preceding interval covers `bbl'.
     '''
-    cache = None
-    total = None
+    index = bisect.bisect_right(keys, bbl) - 1
+    if index < 0:
+        return None
+    left = lefts[index]
+    right = rights[index]
+    if left < bbl and right > bbl:
+        return (left, right)
+    return None
 
+try:
+    # optional C accelerator, built with `python setup.py build_ext'.
+    # Its kernel reads the columns with a fixed 8-byte stride, so it
+    # is only usable where array('L') items are 8 bytes (64-bit
+    # Unix); on 4-byte platforms (Windows, 32-bit builds) it would
+    # silently misread the buffers, so the bisect fallback stays.
+    if array.array('L').itemsize != 8:
+        raise ImportError('array("L") items are not 8 bytes')
+    from _blockcache import find_interval as _find_interval
+except ImportError:
+    _find_interval = _py_find_interval
+
+class BlockCache(object):
+    '''
+        Basic block cache implementation. It is based on a plain
+        dictionary keyed by the start address of each BBL, plus a
+        lazily-sorted array of the keys that is used for bisection
+        lookups of enclosing BBLs.
+    '''
+    __slots__ = (
+            'cache', 'total', '_keys', '_lefts', '_rights', '_dirty',
+            '_last_left', '_last_right', '_last_val', '_cache_get'
+            )
 
     def __init__(self):
-        self.cache = sc.SortedDict()
+        self.cache = {}
+        # bound once: the cache dict is never replaced, only updated,
+        # and get_cached runs once per trace record
+        self._cache_get = self.cache.get
         self.total = 0x0
+        self._keys = array.array('L')
+        self._lefts = array.array('L')
+        self._rights = array.array('L')
+        self._dirty = True
+        self._last_left = -1
+        self._last_right = -1
+        self._last_val = None
 
     def yield_bbls(self):
         '''
-            returns a generator for all basic blocks inside
-            the cache.
+            returns a generator for all basic blocks inside the
+            cache, in no particular order. The consumers only build
+            lookup tables and counters from these, so the cached
+            (start_ea, end_ea) tuples are yielded as stored, without
+            sorting or re-packing.
         '''
-        for start_ea, end_ea in self.cache.itervalues():
-            yield (start_ea, end_ea)
+        for bbl in self.cache.itervalues():
+            yield bbl
 
     def get_count(self):
         '''
@@ -40,6 +83,10 @@ class BlockCache(object):
         if key == value[0]:
             self.total += 1
         self.cache[key] = value
+        self._dirty = True
+        # drop the memoized interval if the new BBL overlaps it
+        if value[0] < self._last_right and value[1] > self._last_left:
+            self._last_right = -1
 
     def get_bbl(self, bbl):
         '''
@@ -59,43 +106,80 @@ class BlockCache(object):
             if the bbl is cached then it retrieves the
             cached value, or in case it's not, it adds
             it to the cache and then returns the value.
+
+            Consecutive lookups usually fall inside the same BBL,
+            so the last interval that was resolved is memoized and
+            checked before anything else.
         '''
-        if self.is_cached(bbl):
-            return self.get_bbl(bbl)
+        if self._last_left <= bbl < self._last_right:
+            return self._last_val
+
+        val = self._cache_get(bbl)
+        if val is not None:
+            self._last_left = val[0]
+            self._last_right = val[1]
+            self._last_val = val
+            return val
 
-        bindex = self.cache.bisect(bbl)
-        bstart = self.cache.iloc[bindex]
-        left, right = self.get_bbl(bstart)
-        if left < bbl and right > bbl:
-            self.add_bbl(bbl, (left, right))
-            return (left, right)
-        else:
-            return None
+        if self._dirty:
+            self._rebuild()
+
+        val = _find_interval(self._keys, self._lefts, self._rights, bbl)
+        if val is not None:
+            # memoize the interior address straight into the dict: the
+            # key arrays never need it, since bisect keeps resolving it
+            # through the covering interval, so going through add_bbl
+            # here would dirty them and force a re-sort per first-seen
+            # interior address. total is untouched (bbl != val[0]).
+            self.cache[bbl] = val
+            self._last_left = val[0]
+            self._last_right = val[1]
+            self._last_val = val
+        return val
+
+    def _rebuild(self):
+        '''
+            re-sorts the key array and the parallel interval columns
+            that feed the C (or fallback) lookup kernel.
+        '''
+        cache = self.cache
+        keys = sorted(cache)
+        self._keys = array.array('L', keys)
+        self._lefts = array.array('L', [cache[key][0] for key in keys])
+        self._rights = array.array('L', [cache[key][1] for key in keys])
+        self._dirty = False
 
     @classmethod
     def parse_idmp(cls, idmp_iterable):
         '''
             parse the output of the disassembler module.
+
+            The lines of the BBL section are collected first and
+            converted in one batch, so the per-line loop does not
+            pay for splitting, integer conversion and method
+            dispatch on every basic block.
         '''
         mode = None
         cache = cls()
+        bbl_lines = []
+        collect = bbl_lines.append
 
         for line in idmp_iterable:
-            if '#' in line:
-                if '#IMAGE#' in line:
+            if line.startswith('#'):
+                if line.startswith('##IMAGE##'):
                     mode = 'image'
-                elif '#FUNCTIONS#' in line:
+                elif line.startswith('##FUNCTIONS##'):
                     mode = 'functions'
-                elif '#BBLS#' in line:
+                elif line.startswith('##BBLS##'):
                     mode = 'bbls'
-            elif mode == 'image':
-                pass
-            elif mode == 'functions':
-                pass
             elif mode == 'bbls':
-                start, end, _ = line.split(',')
-                start = int(start, 16)
-                end = int(end, 16)
-                cache.add_bbl(start, (start, end))
+                collect(line)
+
+        fields = [line.split(',', 2) for line in bbl_lines]
+        starts = [int(field[0], 16) for field in fields]
+        ends = [int(field[1], 16) for field in fields]
+
+        cache.cache.update(zip(starts, zip(starts, ends)))
+        cache.total += len(starts)
 
         return cache
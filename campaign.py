@@ -3,48 +3,120 @@
 import os
 import time
 import shutil
-import random
 import platform
+import atexit
+import struct
+import hashlib
+import itertools
 
-class Singleton(type):
+_IS_LINUX = platform.system() == 'Linux'
+_IS_WINDOWS = platform.system() == 'Windows'
+
+# Monotonically increasing ids, seeded from the wall clock so that
+# different Choronzon processes do not collide. Drawing from the
+# counter is cheap and needs no existence check on disk.
+_counter = itertools.count(int(time.time() * 1000000))
+
+def _write_file(path, data):
+    '''
+        aux: writes a payload to `path' through the raw fd interface,
+        with no stdio buffer sitting between the data and the kernel.
+        `data' may be a single bytestring or a sequence of bytestring
+        fragments; fragments are written back to back on the same fd,
+        so callers that build their payload in pieces never have to
+        concatenate them into one large copy first.
+    '''
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        if isinstance(data, (list, tuple)):
+            for chunk in data:
+                os.write(fd, chunk)
+        else:
+            os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+class _BloomFilter(object):
     '''
-        Assing this class as the __metaclass__ member of a class and it will
-        convert it to a singleton class.
+        Fixed-size Bloom filter over filenames. Long campaigns push an
+        unbounded number of shared chromosome names through the
+        already-processed check; the filter answers the probe from a
+        constant 128 KB of state instead of an ever-growing hash set.
+        Probes may return false positives but never false negatives,
+        so positive answers are confirmed against the disk by the
+        caller.
     '''
-    def __call__(cls, *args, **kwargs):
-        try:
-            return cls.__instance
-        except AttributeError:
-            cls.__instance = super(Singleton, cls).__call__(*args, **kwargs)
-            return cls.__instance
+    __slots__ = ('bits', 'mask')
+
+    SIZE = 1 << 17          # bytes of state, i.e. 2**20 bits
+
+    def __init__(self):
+        self.bits = bytearray(self.SIZE)
+        self.mask = (self.SIZE * 8) - 1
+
+    def _probes(self, name):
+        '''
+            aux: derives four bit indexes from the SHA-1 of the name
+            via double hashing.
+        '''
+        high, low = struct.unpack('<QQ', hashlib.sha1(name).digest()[:16])
+        mask = self.mask
+        return ((high + i * low) & mask for i in (0, 1, 2, 3))
+
+    def add(self, name):
+        bits = self.bits
+        for index in self._probes(name):
+            bits[index >> 3] |= 1 << (index & 7)
+
+    def __contains__(self, name):
+        bits = self.bits
+        for index in self._probes(name):
+            if not (bits[index >> 3] >> (index & 7)) & 1:
+                return False
+        return True
+
+
+# the single Campaign instance of this process. Funnelling every
+# Campaign() call through one module-level slot keeps instantiation
+# down to an `if' -- no metaclass dispatch, no AttributeError-driven
+# control flow on the call path.
+_instance = None
 
 
 class Campaign(object):
     '''
         A singleton class for managing files and directories in a campaign.
     '''
-    __metaclass__ = Singleton
-    campaign_id = None
-    work_dir = None
-    temp_dir = None
-    local_dir = None
-    shared_dir = None
-    campaign_dir = None
-    files = None
-    shared_files = None
-    chromo_files = None
+    __slots__ = (
+            'campaign_id', 'work_dir', 'temp_dir', 'local_dir',
+            'shared_dir', 'campaign_dir', 'chromo_dir', 'fast_dir',
+            'logfp', 'files', 'shared_files', 'chromo_files',
+            'chromo_hashes'
+            )
+
+    def __new__(cls, *args, **kwargs):
+        global _instance
+        if _instance is None:
+            obj = super(Campaign, cls).__new__(cls)
+            obj.campaign_id = None
+            _instance = obj
+        return _instance
 
     def __init__(self, campaign_id=None, work_dir='.'):
         if self.campaign_id == None:
-            self.files = []
-            self.shared_files = []
+            self.shared_dir = None
+            # maps the name of every file add()ed or create()d in the
+            # campaign to its full path
+            self.files = {}
+            self.shared_files = _BloomFilter()
             self.chromo_files = {}
+            self.chromo_hashes = {}
             self.work_dir = self.__checkfilename(work_dir)
             self.new_campaign(campaign_id)
 
     def log(self, msg):
         self.logfp.write('%s\n' % msg)
-        self.logfp.flush()
 
     def copy_directory(self, input_path, name=None):
         '''
@@ -57,10 +129,10 @@ class Campaign(object):
 
         path = self.create_directory(name)
         for filename in os.listdir(input_path):
-            name = os.path.join(input_path, filename)
-            with open(name, 'rb') as fin:
-                with open(os.path.join(path, filename), 'wb') as fout:
-                    fout.write(fin.read())
+            shutil.copyfile(
+                    os.path.join(input_path, filename),
+                    os.path.join(path, filename)
+                    )
         return path
 
     def __checkfilename(self, directory):
@@ -77,12 +149,10 @@ class Campaign(object):
 
     def new_id(self):
         '''
-            crafts an unique id for a campaign by combining a timestamp
-            and a random number.
+            crafts an unique id for a campaign from the module-level
+            counter.
         '''
-        newid = random.random().as_integer_ratio()[0]
-        newid += time.time().as_integer_ratio()[1]
-        return 'campaign-%d' % newid
+        return 'campaign-%d' % next(_counter)
 
     def new_campaign(self, campaign_id=None):
         '''
@@ -98,7 +168,22 @@ class Campaign(object):
         self.temp_dir = self.create_directory('.tmp')
         self.local_dir = self.create_directory('.local')
         self.chromo_dir = self.create_directory('.chromo')
-        self.logfp = open(os.path.join(self.campaign_dir, 'log.txt'), 'a')
+
+        # short-lived seed files are written once and read right back
+        # by the instrumented target; keeping them on a RAM-backed
+        # filesystem avoids the round trip through the disk.
+        self.fast_dir = self.campaign_dir
+        if _IS_LINUX and os.path.isdir('/dev/shm'):
+            path = os.path.join('/dev/shm', self.campaign_id)
+            if not os.path.exists(path):
+                os.makedirs(path)
+            self.fast_dir = path
+        # a large buffer coalesces the chatty per-chromosome messages
+        # into a few big write syscalls; atexit drains whatever is
+        # still buffered when the fuzzer goes down.
+        self.logfp = open(os.path.join(self.campaign_dir, 'log.txt'), 'a',
+                          65536)
+        atexit.register(self.logfp.flush)
         self.log('Log opened for writing at %s' % time.ctime())
 
     def get_chromosome(self, uid):
@@ -114,12 +199,27 @@ class Campaign(object):
     def add_chromosome(self, uid, data):
         '''
             inserts a chromosome in the chromosome directory and it
-            updates the path to the file.
-        '''
+            updates the path to the file. `data' may also be a list
+            or tuple of bytestring fragments, which are written
+            without being joined first. A store whose bytes match what
+            was last written for the uid is recognized by content hash
+            and skipped, so re-storing an unchanged chromosome (the
+            elitism carryover does this for every retained one) costs
+            a hash over memory instead of disk I/O.
+        '''
+        digest = hashlib.sha256()
+        if isinstance(data, (list, tuple)):
+            for chunk in data:
+                digest.update(chunk)
+        else:
+            digest.update(data)
+        digest = digest.digest()
+
         path = os.path.join(self.chromo_dir, '%s' % uid)
         path = os.path.abspath(path)
-        with open(path, 'wb') as fout:
-            fout.write(data)
+        if self.chromo_hashes.get(uid) != digest:
+            _write_file(path, data)
+            self.chromo_hashes[uid] = digest
         self.chromo_files[uid] = path
         return path
 
@@ -133,25 +233,25 @@ class Campaign(object):
 
         os.remove(self.chromo_files[uid])
         del self.chromo_files[uid]
+        self.chromo_hashes.pop(uid, None)
 
     def cleanup(self):
         '''
             deletes the campaign directory.
         '''
         shutil.rmtree(self.campaign_dir)
+        if self.fast_dir != self.campaign_dir:
+            shutil.rmtree(self.fast_dir, True)
 
     def copy_to_campaign(self, filename):
         '''
             aux: copies the filename to the campaign_dir directory.
         '''
         name = os.path.basename(filename)
-        with open(filename, 'rb') as fin:
-            newpath = os.path.join(
-                    self.campaign_dir,
-                    name
-                    )
-            with open(newpath, 'wb') as fout:
-                fout.write(fin.read())
+        shutil.copyfile(
+                filename,
+                os.path.join(self.campaign_dir, name)
+                )
 
     def create_shared_directory(self, abspath):
         '''
@@ -159,7 +259,7 @@ class Campaign(object):
             with other Choronzon's instances. If the directory does not exist,
             it will create it.
         '''
-        self.shared_files = []
+        self.shared_files = _BloomFilter()
         if not os.path.exists(abspath):
             os.makedirs(abspath)
         self.shared_dir = abspath
@@ -179,13 +279,13 @@ class Campaign(object):
         '''
             Deletes a named pipe.
         '''
-        if platform.system() == 'Linux':
+        if _IS_LINUX:
             try:
                 os.unlink(pipe_name)
             except OSError as oserr:
                 print '[!] ERROR: Could not delete pipe:', oserr
 
-        elif platform.system() == 'Windows':
+        elif _IS_WINDOWS:
             # Windows delete automatically the pipe when all handles to it
             # are closed. So there's nothing to delete.
             pass
@@ -196,13 +296,12 @@ class Campaign(object):
             underlying operating system.
         '''
         name = None
-        if platform.system() == 'Linux':
-            pipe_absname = os.path.join(self.temp_dir, 'pipe%s' % seedid)
-            while os.path.exists(pipe_absname):
-                pipe_absname = os.path.join(self.temp_dir,
-                                'pipe%s' % str(random.randint(0, 0xFFFFFFFF)))
-            name = pipe_absname
-        elif platform.system() == 'Windows':
+        if _IS_LINUX:
+            # the counter guarantees a fresh name, so there is no need
+            # to stat the filesystem for collisions.
+            name = os.path.join(self.temp_dir,
+                            'pipe%s_%d' % (seedid, next(_counter)))
+        elif _IS_WINDOWS:
             # name = '\\\\.\\pipe%s' % seedid
             name = 'pipe%s' % seedid
             # should check here, if the pipe already exists.
@@ -212,8 +311,9 @@ class Campaign(object):
 
     def create(self, filename, data=None):
         '''
-            create a new file inside the temporary directory.
-            if data is defined, write the data into the new file.
+            create a new file inside the fast (RAM-backed, if available)
+            directory. if data is defined, write the data into the new
+            file.
         '''
         if filename in self.files:
             raise ValueError(
@@ -221,14 +321,10 @@ class Campaign(object):
                 % filename
                 )
         name = os.path.basename(filename)
-        self.files.append(name)
-        filepath = self.get(name)
+        filepath = os.path.join(self.fast_dir, name)
+        self.files[name] = filepath
         if data != None:
-            with open(
-                    filepath,
-                    'wb'
-                    ) as fout:
-                fout.write(data)
+            _write_file(filepath, data)
 
         return filepath
 
@@ -240,10 +336,11 @@ class Campaign(object):
             does nothing.
         '''
         if not self.already_processed(filename):
-            self.shared_files.append(filename)
-            with open(os.path.join(self.shared_dir, filename), 'r') as fin:
-                with open(os.path.join(self.local_dir, filename), 'wb') as fout:
-                    fout.write(fin.read())
+            self.shared_files.add(filename)
+            shutil.copyfile(
+                    os.path.join(self.shared_dir, filename),
+                    os.path.join(self.local_dir, filename)
+                    )
         return os.path.join(self.local_dir, filename)
 
     def already_processed(self, filename):
@@ -252,45 +349,46 @@ class Campaign(object):
             chromosome pointed by `filename'. Process could mean, that either
             this instance of the fuzzer dumped the chromosome in the shared
             directory or the chromosome was imported from the shared directory.
+
+            A positive Bloom probe may be a false positive, so it is
+            confirmed against the local directory, where every processed
+            chromosome has a copy.
         '''
-        return filename in self.shared_files
+        if filename not in self.shared_files:
+            return False
+        return os.path.exists(os.path.join(self.local_dir, filename))
 
     def dump_to_shared(self, filename, bytestring):
         '''
             Dumps a bytestring into the shared directory and into a local
-            directory.
+            directory. Like add_chromosome, a list or tuple of fragments
+            is accepted as well.
         '''
-        if filename not in self.shared_files:
-            self.shared_files.append(filename)
+        if not self.already_processed(filename):
+            self.shared_files.add(filename)
             path = os.path.join(self.shared_dir, filename)
             localpath = os.path.join(self.local_dir, filename)
-            with open(path, 'wb') as fout:
-                fout.write(bytestring)
-            with open(localpath, 'wb') as fout:
-                fout.write(bytestring)
+            _write_file(path, bytestring)
+            _write_file(localpath, bytestring)
 
     def get(self, filename):
         '''
-            retrieve a file already add()ed in the campaign.
+            retrieve the path of a file already add()ed or create()d in
+            the campaign.
         '''
         if filename not in self.files:
             raise IndexError(
                 'File "%s" was not found'
                 % filename
                 )
-        return os.path.join(
-            self.campaign_dir,
-            filename
-            )
+        return self.files[filename]
 
     def add_to(self, out, inp):
         '''
             Copies `filename' to `fullpath' directory.
         '''
         outfull = os.path.join(out, os.path.basename(inp))
-        with open(inp) as fin:
-            with open(outfull, 'wb') as fout:
-                fout.write(fin.read())
+        shutil.copyfile(inp, outfull)
         return outfull
 
     def add(self, filename):
@@ -300,6 +398,6 @@ class Campaign(object):
         name = os.path.basename(filename)
         if name not in self.files:
             self.copy_to_campaign(filename)
-            self.files.append(name)
+            self.files[name] = os.path.join(self.campaign_dir, name)
         return self.get(name)
 
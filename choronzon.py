@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 import sys
 import os
+import shutil
 import argparse
+import collections
+import multiprocessing
 
 import world
 import chromosome
@@ -12,6 +15,20 @@ import tracer
 import evaluator
 
 
+# Tracer used by the analysis worker processes. The pool is forked
+# right before the runs are dispatched, so the workers inherit the
+# fully initialized tracer (pin command template, basic block caches,
+# campaign file table) from the parent through this slot.
+_worker_tracer = None
+
+def _trace_seed(seedid):
+    '''
+        Pool worker: traces a single seed file and returns the Trace
+        object to the parent process.
+    '''
+    return _worker_tracer.analyze(seedid)
+
+
 class Choronzon(object):
     '''
         https://en.wikipedia.org/wiki/Choronzon
@@ -37,6 +54,10 @@ class Choronzon(object):
         seedpath = self.campaign.copy_directory(
                 self.configuration['InitialPopulation'], name='seedfiles')
 
+        self.cores = 1
+        if 'Cores' in self.configuration:
+            self.cores = self.configuration['Cores']
+
         self.tracer = tracer.Tracer()
         self.strategy = strategy.FuzzingStrategy()
         self.population = world.Population(self.tracer.cache)
@@ -47,6 +68,7 @@ class Choronzon(object):
                     self.configuration['ChromosomeShared'])
         except:
             self.sharedpath = None
+        self.shared_mtime = None
 
         # Initialize factory for building chromosome
         # and the proxy for computing the fitness.
@@ -61,7 +83,21 @@ class Choronzon(object):
             This functions is looking for files in the shared directory. If a
             file has not already been processed, it uses it to build a new
             Chromosome and import it into the current population.
+
+            The directory's mtime changes whenever an entry is added or
+            removed, so it acts as a high-water mark: if it has not
+            moved since the last scan, no other instance dumped
+            anything and the listing is skipped altogether.
         '''
+        try:
+            mtime = os.stat(self.sharedpath).st_mtime
+        except OSError:
+            return
+
+        if mtime == self.shared_mtime:
+            return
+        self.shared_mtime = mtime
+
         listed_files = os.listdir(self.sharedpath)
 
         for curr in listed_files:
@@ -88,20 +124,15 @@ class Choronzon(object):
 
         # This is to keep the family tree of the chromosomes
         for male, female in self.population.get_couple_from_previous(True):
-            # assume that the UID is colliding with another's chromosome UID
-            uid_collision = True
-
             maleclone = male.clone()
             femaleclone = female.clone()
 
-            # assign new UIDs to the new chromosomes until they are unique
-            while uid_collision:
-                if self.population.does_exist(maleclone.uid) == False and \
-                        self.population.does_exist(femaleclone.uid) == False:
-                    uid_collision = False
-                else:
-                    maleclone.new_uid()
-                    femaleclone.new_uid()
+            # in a 64 bit uid space collisions are next to nonexistent;
+            # if one does happen, redraw only for the colliding clone
+            while self.population.does_exist(maleclone.uid):
+                maleclone.new_uid()
+            while self.population.does_exist(femaleclone.uid):
+                femaleclone.new_uid()
 
             son, daughter = self.strategy.recombine(maleclone, femaleclone)
 
@@ -115,13 +146,22 @@ class Choronzon(object):
             gpath = self.campaign.create_directory(
                     '%s' % self.population.epoch
                     )
-            for chromo in self.population.get_all_from_current():
-                path = os.path.join(
-                            '%s' % gpath,
-                            '%s' % chromo.uid
-                            )
-                with open(path, 'wb') as fout:
-                    fout.write(chromo.serialize())
+            self._dump_generation(gpath)
+
+    def _dump_generation(self, dirpath):
+        '''
+            Keeps a copy of every chromosome of the current generation
+            under `dirpath'. All chromosomes are serialized up front and
+            the blobs are then flushed back to back with raw fd writes,
+            keeping the stdio layer and the serializer out of the write
+            loop.
+        '''
+        blobs = [
+                ('%s' % chromo.uid, chromo.serialize())
+                for chromo in self.population.get_all_from_current()
+                ]
+        for name, blob in blobs:
+            campaign._write_file(os.path.join(dirpath, name), blob)
 
     def evaluate_fuzzers(self):
         '''
@@ -131,30 +171,28 @@ class Choronzon(object):
             the pair is more likely to be chosen based on the lottery selector.
         '''
 
-        involved = {}
-
-        # for every derived chromosome (it has a fuzzer) assign it a fuzzer
-        # score of 0. This step only considers chromosomes that have been
-        # involved in this fuzzing cycle.
-        for chromo in self.population.get_all_from_previous():
-            if chromo.fuzzer == None:
-                continue
-            if chromo.fuzzer not in involved:
-                involved[chromo.fuzzer] = 0
-
-        # for every chromosome that is involved (has been generated in this
-        # step) and has survived, increase its fuzzer's score by one
-        for chromo in self.population.get_all_from_current():
-            if chromo.fuzzer == None:
-                continue
-            if chromo.fuzzer not in involved:
-                involved[chromo.fuzzer] = 0
-            else:
-                involved[chromo.fuzzer] += 1
+        # the fuzzers that took part in this fuzzing cycle
+        involved = set(
+                chromo.fuzzer
+                for chromo in self.population.get_all_from_previous()
+                if chromo.fuzzer != None
+                )
+
+        # count the surviving chromosomes of each fuzzer in a single
+        # C-level pass instead of growing a score dictionary manually
+        survivors = collections.Counter(
+                chromo.fuzzer
+                for chromo in self.population.get_all_from_current()
+                if chromo.fuzzer != None
+                )
 
         # update the strategy instance with the new fuzzer scores, so that
         # the mutator/combinator pair is more likely to be chosen again
-        for fuzzer, score in involved.iteritems():
+        for fuzzer, score in survivors.iteritems():
+            # a fuzzer that was not part of this cycle does not score
+            # for its first survivor
+            if fuzzer not in involved:
+                score -= 1
             if score > 0:
                 self.strategy.good(fuzzer, score)
 
@@ -163,6 +201,33 @@ class Choronzon(object):
             #else:
             #    self.strategy.bad(fuzzer)
 
+    def _run_tracers(self, uids):
+        '''
+            runs the tracer over every seed of the current generation and
+            returns a {uid: trace} dictionary. When the `Cores'
+            configuration option is greater than one, the runs are fanned
+            out to a pool of worker processes. The runs are independent
+            (each traces its own seed file over its own pipe) and are
+            dominated by the instrumented target, so they scale with the
+            core count.
+        '''
+        global _worker_tracer
+
+        seedids = ['%s' % uid for uid in uids]
+
+        if self.cores > 1 and len(seedids) > 1:
+            _worker_tracer = self.tracer
+            pool = multiprocessing.Pool(min(self.cores, len(seedids)))
+            try:
+                traces = pool.map(_trace_seed, seedids)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            traces = [self.tracer.analyze(seedid) for seedid in seedids]
+
+        return dict(zip(uids, traces))
+
     def analyze(self):
         '''
             Analyze the corpus of the current generation, by instrumenting the
@@ -175,22 +240,32 @@ class Choronzon(object):
             )
         crashed_uids = []
 
-        for chromo in self.population.get_all_from_current():
-            newfile = self.campaign.create(
-                                    '%s' % chromo.uid,
-                                    chromo.serialize()
-                                    )
-            self.campaign.log('Analyzing %s' % chromo.uid)
-            trace = self.tracer.analyze('%s' % chromo.uid)
-            self.campaign.log('Analysis of %s finished' % chromo.uid)
+        # write out every seed file before dispatching the tracer runs,
+        # so the worker processes inherit a complete campaign file table
+        chromosomes = self.population.get_all_from_current()
+        for chromo in chromosomes:
+            self.campaign.create(
+                    '%s' % chromo.uid,
+                    chromo.serialize()
+                    )
+
+        traces = self._run_tracers([chromo.uid for chromo in chromosomes])
+        self.campaign.log('Analysis of the generation finished.')
+
+        for chromo in chromosomes:
+            trace = traces[chromo.uid]
+            newfile = self.campaign.get('%s' % chromo.uid)
 
             # if the fuzzed file triggered a bug (yay!!), remove it from the
             # population, since it may trigger the same bug again and again
             if trace.has_crashed:
                 crash_dir = self.campaign.create_directory('crashes')
                 path = os.path.join(crash_dir, '%s' % chromo.uid)
-                with open(path, 'wb') as fout:
-                    fout.write(chromo.serialize())
+                # the seed file the tracer just ran holds exactly these
+                # bytes; move it instead of serializing them again
+                # (shutil.move copies when the crash directory is on a
+                # different filesystem than the fast seed directory)
+                shutil.move(newfile, path)
                 self.campaign.log('CRASH! :)')
                 self.campaign.log('The trigger file is saved at %s.' % path)
                 crashed_uids.append(chromo.uid)
@@ -232,20 +307,25 @@ class Choronzon(object):
         # if there are multiple instances of choronzon, dump the chromosomes
         # from the elite generation to the shared directory.
         if self.sharedpath != None:
+            shared_coverage = self.tracer.shared_coverage
             for chromo in self.population.get_all_from_current():
                 filename = str(chromo.uid)
-                if not self.campaign.already_processed(filename):
-                    self.campaign.dump_to_shared(filename,
-                                        chromo.dumps_chromosome())
+                if self.campaign.already_processed(filename):
+                    continue
+                # skip chromosomes whose basic blocks have all been
+                # seen by some instance already; they would only make
+                # the others churn through redundant imports
+                if shared_coverage != None and chromo.trace != None \
+                        and not shared_coverage.merge(chromo.trace):
+                    continue
+                self.campaign.dump_to_shared(filename,
+                                    chromo.dumps_chromosome())
 
         elite_dir = self.campaign.create_directory('%s' % self.population.epoch)
 
         if 'KeepGenerations' in self.configuration \
                             and self.configuration['KeepGenerations']:
-            for chromo in self.population.get_all_from_current():
-                path = os.path.join(elite_dir, '%s' % chromo.uid)
-                with open(path, 'wb') as fout:
-                    fout.write(chromo.serialize())
+            self._dump_generation(elite_dir)
 
     def start(self):
         while True:
@@ -0,0 +1,47 @@
+# cython: boundscheck=False
+'''
+    Optional Cython accelerator for the gene tree walks in
+    chromosome.py. The walks only touch Python objects, but compiling
+    them removes the interpreter dispatch around the stack handling,
+    which is all these loops do. chromosome.py falls back to the pure
+    Python versions when this module has not been built.
+'''
+
+def walk_all(roots):
+    '''
+        flattens the given gene subtrees into a list, parents before
+        their children.
+    '''
+    cdef list out = []
+    cdef list stack = list(roots)
+    cdef object gene, children
+
+    while stack:
+        gene = stack.pop()
+        out.append(gene)
+        children = gene.children
+        if children:
+            stack.extend(children)
+
+    return out
+
+def build_parent_map(roots):
+    '''
+        maps id(gene) to a (parent gene, position) tuple for every
+        inner gene of the given subtrees, position being the gene's
+        index in its parent's children list.
+    '''
+    cdef dict parents = {}
+    cdef list stack = list(roots)
+    cdef object gene, child
+    cdef Py_ssize_t index
+
+    while stack:
+        gene = stack.pop()
+        index = 0
+        for child in gene.children:
+            parents[id(child)] = (gene, index)
+            stack.append(child)
+            index += 1
+
+    return parents
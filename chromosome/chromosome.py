@@ -2,9 +2,92 @@
     The Chromosome module.
 '''
 import os
-import copy
-import random
+import struct
+import marshal
 import cPickle
+import cStringIO
+
+import tracer
+
+# one Pickler is constructed and reused for every chromosome dump.
+# fast mode skips the memo bookkeeping, which is safe here because the
+# dumped gene trees and traces are acyclic; objects referenced twice
+# would merely be written out twice.
+_PICKLE_BUFFER = cStringIO.StringIO()
+_PICKLER = cPickle.Pickler(_PICKLE_BUFFER, cPickle.HIGHEST_PROTOCOL)
+_PICKLER.fast = 1
+
+def _dumps_fast(obj):
+    '''
+        aux: pickles `obj' with the reused fast-mode Pickler and
+        returns the bytestring.
+    '''
+    _PICKLE_BUFFER.seek(0)
+    _PICKLE_BUFFER.truncate()
+    _PICKLER.clear_memo()
+    _PICKLER.dump(obj)
+    return _PICKLE_BUFFER.getvalue()
+
+# uids are drawn in batches: one os.urandom read and one struct call
+# refill 512 of them, so the per-chromosome cost is a list pop instead
+# of a fresh trip through the random machinery.
+_UID_BUFFER = []
+
+def _next_uid():
+    '''
+        aux: returns a random 64 bit uid from the batch buffer,
+        refilling it when it runs dry.
+    '''
+    if not _UID_BUFFER:
+        _UID_BUFFER.extend(struct.unpack('<512Q', os.urandom(4096)))
+    return _UID_BUFFER.pop()
+
+def _py_walk_all(roots):
+    '''
+        pure Python fallback: flattens the given gene subtrees into a
+        list with an explicit stack.
+    '''
+    out = []
+    append = out.append
+    stack = list(roots)
+    pop = stack.pop
+    extend = stack.extend
+
+    while stack:
+        gene = pop()
+        append(gene)
+        if gene.children:
+            extend(gene.children)
+
+    return out
+
+def _py_map_parents(roots):
+    '''
+        pure Python fallback: maps id(gene) to a (parent gene,
+        position) tuple for every inner gene of the given subtrees,
+        position being the gene's index in its parent's children
+        list.
+    '''
+    parents = {}
+    stack = list(roots)
+    pop = stack.pop
+    push = stack.append
+
+    while stack:
+        gene = pop()
+        for index, child in enumerate(gene.children):
+            parents[id(child)] = (gene, index)
+            push(child)
+
+    return parents
+
+try:
+    # optional Cython accelerator, built with `python setup.py build_ext'
+    from chromosome._gene import walk_all as _walk_all
+    from chromosome._gene import build_parent_map as _map_parents
+except ImportError:
+    _walk_all = _py_walk_all
+    _map_parents = _py_map_parents
 
 class Chromosome(object):
     '''
@@ -36,6 +119,11 @@ class Chromosome(object):
     fuzzer = None
     uid = None
     processed = None
+    _parent_map = None
+    _serialized = None
+    _rootids = None
+    _gene_buckets = None
+    _all_genes = None
 
     def __init__(self, serializer=None, deserializer=None):
         self.genes = list()
@@ -45,6 +133,11 @@ class Chromosome(object):
         self.fitness = 0.0
         self.uid = self.new_uid()
         self.processed = False
+        self._parent_map = None
+        self._serialized = None
+        self._rootids = None
+        self._gene_buckets = None
+        self._all_genes = None
 
     def __len__(self):
         return len(self.genes)
@@ -56,15 +149,23 @@ class Chromosome(object):
         '''
             Assign a new random UID to the chromosome.
         '''
-        self.uid = random.randint(0, 0xFFFFFFFFFFFFFFFF)
+        self.uid = _next_uid()
         return self.uid
 
     def clone(self):
         '''
             Clone the chromosome object, but assign a new unique identifier
-            to the new chromosome.
-        '''
-        newchr = copy.deepcopy(self)
+            to the new chromosome. The copy is made through cPickle with
+            the binary protocol, which runs in C end to end and is much
+            cheaper than copy.deepcopy's generic memo-driven walk.
+        '''
+        newchr = cPickle.loads(cPickle.dumps(self, -1))
+        # the parent map and the root id set are keyed by id() of the
+        # original gene objects, which mean nothing to the copies
+        newchr._parent_map = None
+        newchr._rootids = None
+        newchr._gene_buckets = None
+        newchr._all_genes = None
         newchr.new_uid()
         return newchr
 
@@ -100,51 +201,63 @@ class Chromosome(object):
 
     def get_all_genes(self):
         '''
-            Returns all genes of the current chromosome.
+            Returns all genes of the current chromosome. The flattened
+            list is memoized: the recombinators ask for it several
+            times per recombination, and the trees only change through
+            the mutating entry points, which all go through
+            invalidate(). Callers must not modify the returned list.
         '''
-        return self._get_all_ancestors(self.get_genes())
+        if self._all_genes == None:
+            self._all_genes = self._get_all_ancestors(self.get_genes())
+        return self._all_genes
 
     def _get_all_ancestors(self, genes):
         '''
-            Returns a list with all ancestor genes (including the input genes)
+            Returns a list with all genes of the given subtrees (including
+            the input genes). The traversal is iterative with an explicit
+            stack, so deep gene trees neither pay a Python frame per node
+            nor run into the recursion limit.
         '''
-        ancestors = []
-
-        for parent_gene in genes:
-            # add itself in the list
-            ancestors.append(parent_gene)
-            # for every children of the current gene
-            for child in parent_gene.get_children():
-                # if the child of the current gene contains children,
-                # call _get_all_ancestors recursively
-                if child.children_number() > 0:
-                    ancestors.extend(
-                                        self._get_all_ancestors(
-                                              child.get_children()
-                                        )
-                                    )
-                else:
-                    ancestors.append(child)
+        return _walk_all(genes)
 
-        return ancestors
-
-    def _internal_find_parent(self, root, target):
+    def get_gene_buckets(self):
         '''
-            A breadth first greedy search algorithm. Given a root node
-            it returns the parent gene of the target. Returns None if the
-            parent could not be found.
+            Returns the genes of the chromosome grouped by their
+            signature(), leaving out genes that match nothing. The
+            similarity recombinators probe this index with one lookup
+            per candidate instead of comparing every gene pair; it is
+            memoized and dropped by invalidate() like the other
+            derived views of the gene trees.
         '''
-        parent = None
-
-        if target in root.get_children():
-            return root
+        if self._gene_buckets == None:
+            buckets = {}
+            for gene in self.get_all_genes():
+                key = gene.signature()
+                if key == None:
+                    continue
+                buckets.setdefault(key, []).append(gene)
+            self._gene_buckets = buckets
+        return self._gene_buckets
 
-        for child in root.get_children():
-            parent = self._internal_find_parent(child, target)
-            if parent != None:
-                break
+    def _build_parent_map(self):
+        '''
+            aux: walks the gene trees once and records the parent of
+            every inner gene, keyed by id() since gene objects compare
+            by identity. The map is built lazily and dropped whenever
+            the trees change shape, so find_parent is a dictionary
+            lookup instead of a fresh search per call.
+        '''
+        self._parent_map = _map_parents(self.genes)
 
-        return parent
+    def _is_root(self, gene):
+        '''
+            aux: O(1) test for whether the gene is one of the top level
+            genes. Genes compare by identity, so a set of their ids is
+            equivalent to a linear scan of the root list.
+        '''
+        if self._rootids == None:
+            self._rootids = frozenset(id(gene) for gene in self.genes)
+        return id(gene) in self._rootids
 
     def find_parent(self, child):
         '''
@@ -153,18 +266,26 @@ class Chromosome(object):
             the gene does not belong to this chromosome, it raises
             a ValueError exception.
         '''
-        if child in self.genes:
-            return None
+        return self.find_parent_position(child)[0]
+
+    def find_parent_position(self, child):
+        '''
+            Like find_parent, but returns a (parent, position) tuple,
+            position being the gene's index in its parent's children
+            list, so callers that go on to splice the siblings do not
+            rescan them for the gene. Root genes have no parent;
+            (None, -1) is returned for them.
+        '''
+        if self._is_root(child):
+            return None, -1
 
-        parent = None
+        if self._parent_map == None:
+            self._build_parent_map()
 
-        for gene in self.genes:
-            parent = self._internal_find_parent(gene, child)
-            if parent != None:
-                break
+        entry = self._parent_map.get(id(child))
 
-        if parent != None:
-            return parent
+        if entry != None:
+            return entry
         else:
             raise ValueError('Unable to find parent of gene.')
 
@@ -174,13 +295,14 @@ class Chromosome(object):
         '''
         old = None
 
-        if target in self.genes:
+        if self._is_root(target):
             index = self.genes.index(target)
             old = self.genes[index]
             self.genes[index] = new
         else:
             parent = self.find_parent(target)
             old = parent.replace_child(target, new)
+        self.invalidate()
         return old
 
     def remove_gene(self, target):
@@ -193,12 +315,14 @@ class Chromosome(object):
             parent.remove_child(target)
         else:
             self.genes.remove(target)
+        self.invalidate()
 
     def add_gene(self, gene):
         '''
             Appends a top level gene in the chromosome.
         '''
         self.genes.append(gene)
+        self.invalidate()
 
     def deserialize(self, filepath):
         '''
@@ -206,23 +330,56 @@ class Chromosome(object):
             user-defined deserializer.
         '''
         self.genes = self.deserializer.deserialize(filepath)
+        self.invalidate()
 
     def serialize(self):
         '''
             Returns a bytestring that is the used as input to the target
             application. It uses a user-defined serializer.
+
+            The bytestring is memoized; the analysis stage, the crash
+            dump and KeepGenerations may all ask for it within one
+            epoch. Everything that alters the genes goes through
+            invalidate().
         '''
-        return self.serializer.serialize(self.genes)
+        if self._serialized == None:
+            self._serialized = self.serializer.serialize(self.genes)
+        return self._serialized
 
-    def dumps_chromosome(self, protocol=-1):
+    def invalidate(self):
         '''
-            It returns pickled bytestring containing the important attributes
-            of the chromosome that are needed in order to write the chromosome
-            in a file and restore it later or restore it from another Choronzon
-            instance.
+            Drops the memoized serialized form, the parent map and the
+            root id set. Must be called after the gene data or the tree
+            shape has been changed behind the chromosome's back (e.g.
+            by the mutators and recombinators, which patch genes
+            directly).
         '''
-        important = [self.genes, self.metrics, self.uid, self.trace]
-        return cPickle.dumps(important, protocol)
+        self._serialized = None
+        self._parent_map = None
+        self._rootids = None
+        self._gene_buckets = None
+        self._all_genes = None
+
+    def dumps_chromosome(self, protocol=-1):
+        '''
+            It returns a bytestring containing the important attributes
+            of the chromosome that are needed in order to write the
+            chromosome in a file and restore it later or restore it from
+            another Choronzon instance.
+
+            The format is two length-prefixed sections: the metrics,
+            the uid and the trace state go through marshal, which is
+            considerably faster than pickle for plain builtins -- and
+            the trace reduces to lists, sets and numbers through
+            get_state -- while the gene tree (an arbitrary object
+            graph) stays with cPickle.
+        '''
+        state = None
+        if self.trace != None:
+            state = self.trace.get_state()
+        meta = marshal.dumps((self.metrics, self.uid, state))
+        rest = _dumps_fast(self.genes)
+        return struct.pack('<II', len(meta), len(rest)) + meta + rest
 
     def dump_chromosome(self, path, protocol=-1):
         '''
@@ -236,16 +393,47 @@ class Chromosome(object):
 
     def loads_chromosome(self, data):
         '''
-            Restores a chromosome from a pickled string.
+            Restores a chromosome from a bytestring produced by
+            dumps_chromosome.
         '''
-        self.genes, self.metrics, self.uid, self.trace = cPickle.loads(data)
+        meta_len, rest_len = struct.unpack_from('<II', data)
+        offset = struct.calcsize('<II')
+        self.metrics, self.uid, state = marshal.loads(
+                data[offset:offset + meta_len])
+        self.trace = None
+        if state != None:
+            self.trace = tracer.Trace.from_state(state)
+        self.genes = cPickle.loads(
+                data[offset + meta_len:offset + meta_len + rest_len])
+        self.invalidate()
 
     def load_chromosome(self, path):
         '''
-            Restores a chromosome from a pickled file.
+            Restores a chromosome from a dumped file.
         '''
         if not os.path.exists(path):
             raise IOError('Could not find path: %s' % path)
 
         with open(path, 'rb') as fin:
-            self.genes, self.metrics, self.uid, self.trace = cPickle.load(fin)
+            self.loads_chromosome(fin.read())
+
+def load_light(path):
+    '''
+        Reads a dumped chromosome file and returns its (metrics, uid,
+        trace) triple. Only the marshalled head of the file is read and
+        decoded; the pickled gene tree, which dominates both the file
+        size and the restore time, stays untouched on disk. Consumers
+        that need the genes go through load_chromosome as usual.
+    '''
+    if not os.path.exists(path):
+        raise IOError('Could not find path: %s' % path)
+
+    with open(path, 'rb') as fin:
+        header = fin.read(struct.calcsize('<II'))
+        meta_len, _ = struct.unpack('<II', header)
+        metrics, uid, state = marshal.loads(fin.read(meta_len))
+
+    trace = None
+    if state != None:
+        trace = tracer.Trace.from_state(state)
+    return metrics, uid, trace
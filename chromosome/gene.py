@@ -3,7 +3,7 @@ class AbstractGene(object):
     children = None
 
     def __init__(self):
-        self.data = ''
+        self.data = bytearray()
         self.children = []
 
     def get_data(self):
@@ -14,9 +14,31 @@ class AbstractGene(object):
 
     def set_data(self, data):
         '''
-            sets the data of this gene
+            sets the data of this gene. The payload is kept in a
+            bytearray, so mutators can patch single bytes in place
+            instead of rebuilding an immutable bytestring around
+            every change.
         '''
-        self.data = data
+        if isinstance(data, bytearray):
+            self.data = data
+        else:
+            self.data = bytearray(data)
+
+    def clone(self):
+        '''
+            Returns a deep copy of the gene subtree. The recombinators
+            used copy.deepcopy for this, which walks every node
+            through the generic reflective machinery; here only the
+            payload is copied (one memcpy of the bytearray) and the
+            children are cloned recursively, while the remaining
+            attributes (chunk name, length, crc, ...) are immutable
+            and simply carried over.
+        '''
+        new = self.__class__.__new__(self.__class__)
+        new.__dict__.update(self.__dict__)
+        new.data = bytearray(self.data)
+        new.children = [child.clone() for child in self.children]
+        return new
 
     def add_children(self, new):
         self.children.extend(new)
@@ -48,7 +70,7 @@ class AbstractGene(object):
         '''
         index = self.children.index(target)
         old = self.children[index]
-        self.children[index] = target
+        self.children[index] = new
         return old
 
     def children_number(self):
@@ -65,20 +87,29 @@ class AbstractGene(object):
         '''
             uses a Mutator object to corrupt some of its data.
         '''
-        data = mutator.mutate(self.get_data())
+        data = mutator.mutate(bytes(self.get_data()))
         self.set_data(data)
 
     def serialize(self):
         '''
             serializes its data and children's data into
-            a bytestring.
+            a bytestring. The fragments are collected and joined
+            once; repeated `+=' on the bytestring would copy the
+            whole buffer for every child.
         '''
         data = self.get_data()
         if data == None:
             data = ''
+        elif isinstance(data, bytearray):
+            data = bytes(data)
+        if not self.children:
+            return data
+
+        parts = [data]
+        append = parts.append
         for child in self.children:
-            data += child.serialize()
-        return data
+            append(child.serialize())
+        return ''.join(parts)
 
     def is_equal(self, other):
         '''
@@ -86,6 +117,15 @@ class AbstractGene(object):
         '''
         return False
 
+    def signature(self):
+        '''
+            Returns a hashable key that groups genes the same way
+            is_equal pairs them: two genes are equal exactly when
+            their signatures match. None means the gene matches
+            nothing (the base class, like is_equal, matches nothing).
+        '''
+        return None
+
     def __str__(self):
         '''
             Convert the gene to bytestring.
@@ -1,15 +1,70 @@
 import os
 import zlib
 import math
+import mmap
 import struct
 import copy
+import multiprocessing.dummy
 
 import chromosome.gene as gene
 import chromosome.serializer as serializer
 import chromosome.deserializer as deserializer
+import configuration
 
 PNG_SIGNATURE = '\x89\x50\x4e\x47\x0d\x0a\x1a\x0a'
 
+# chunk names as the big-endian integers the parser reads them as,
+# so the hot loops compare plain ints instead of formatting a string
+# per gene via asciiname()
+IDAT_NAME = 0x49444154
+IEND_NAME = 0x49454e44
+
+# any PNG only ever uses a handful of distinct chunk names, so the
+# int-to-ascii conversion is memoized in a small dict
+_ASCIINAME_CACHE = {}
+
+def _asciiname(chunkname):
+    '''
+        aux: converts a chunk name to ascii, remembering the result.
+    '''
+    name = _ASCIINAME_CACHE.get(chunkname)
+    if name is None:
+        name = '%c%c%c%c' % (
+                (chunkname >> 24) & 0xFF,
+                (chunkname >> 16) & 0xFF,
+                (chunkname >> 8) & 0xFF,
+                (chunkname & 0xFF)
+                )
+        _ASCIINAME_CACHE[chunkname] = name
+    return name
+
+try:
+    # optional libdeflate binding; its CRC32 runs on the carryless
+    # multiply units and outpaces stock zlib by a wide margin on the
+    # multi-megabyte IDAT payloads. The checksums are identical.
+    import deflate as _deflate
+    _crc32 = _deflate.crc32
+except ImportError:
+    _deflate = None
+    _crc32 = zlib.crc32
+
+# precompiled header formats; struct.unpack re-resolves the format
+# string on every call, while a Struct object parses it once
+_CHUNK_HDR = struct.Struct('>II')
+_U32 = struct.Struct('>I')
+
+# payloads below this size are checksummed serially; dispatching them
+# to a thread costs more than the CRC itself
+_PARALLEL_CRC_THRESHOLD = 0x10000
+
+def _get_configuration():
+    '''
+        aux: returns the campaign Configuration singleton if it has
+        been created, or None when running outside a campaign.
+    '''
+    return configuration.Singleton._instances.get(
+            configuration.Configuration)
+
 
 class PNGGene(gene.AbstractGene):
     '''
@@ -21,11 +76,17 @@ class PNGGene(gene.AbstractGene):
         the capability to fuzz specific parts of the chunk's contents. For
         example, it is useless to fuzz the CRC field of a PNG chunk.
     '''
+    # set when the serializer has already recomputed the CRC for this
+    # serialization pass; consumed (and cleared) by serialize()
+    _crc_prefixed = False
+
     def __init__(self, chunk):
         super(PNGGene, self).__init__()
         self.length = chunk['length']
         self.name = chunk['name']
-        self.data = chunk['data']
+        # set_data copies any buffer object (str, memoryview of the
+        # inflated stream) into the gene's own bytearray exactly once
+        self.set_data(chunk['data'])
         self.crc = chunk['crc']
 
     def anomaly(self):
@@ -45,50 +106,62 @@ class PNGGene(gene.AbstractGene):
         if not isinstance(other, self.__class__):
             return False
 
-        if self.name == other.name and PNGGene.asciiname(self.name) != 'IEND':
+        if self.name == other.name and self.name != IEND_NAME:
             return True
         else:
             return False
 
+    def signature(self):
+        '''
+            Genes pair up by chunk type, except IEND which is_equal
+            never matches.
+        '''
+        if self.name == IEND_NAME:
+            return None
+        return (self.__class__, self.name)
+
     # This function must be implemented in order 
     def serialize(self):
         '''
             This function is called to serialize in-memory data of a PNG chunk.
         '''
-        self.fix_crc()
+        if self._crc_prefixed:
+            self._crc_prefixed = False
+        else:
+            self.fix_crc()
 
-        bytestring = ''
         chunk_data = super(PNGGene, self).serialize()
 
-        bytestring += struct.pack('>I', len(chunk_data))
-        bytestring += struct.pack('>I', self.name)
-        bytestring += chunk_data
-        bytestring += struct.pack('>I', self.crc)
-
-        return bytestring
+        return ''.join((
+                _CHUNK_HDR.pack(len(chunk_data), self.name),
+                chunk_data,
+                _U32.pack(self.crc),
+                ))
 
     def fix_crc(self):
         '''
             re-calculates the Gene's CRC checksum.
+
+            Most ancillary chunks are tiny, where the fixed cost of a
+            second CRC call outweighs copying the payload; those are
+            checksummed in one call over name+data. Large payloads
+            (the IDATs) skip the concatenation copy and seed the
+            second call with the name's checksum instead.
         '''
-        checksum = zlib.crc32(
-            struct.pack('>I', self.name)
-            )
-        self.crc = zlib.crc32(
-            self.data, checksum
-            ) & 0xffffffff
+        name = struct.pack('>I', self.name)
+        if len(self.data) <= 0x10000:
+            self.crc = _crc32(name + bytes(self.data)) & 0xffffffff
+        else:
+            # buffer() lends the bytearray's storage without a copy;
+            # crc32 does not take bytearrays directly on 2.7
+            self.crc = _crc32(buffer(self.data), _crc32(name)) & 0xffffffff
 
     @staticmethod
     def asciiname(chunkname):
         '''
             Converts a chunk name to ascii and returns it.
         '''
-        return '%c%c%c%c' % (
-                (chunkname >> 24) & 0xFF,
-                (chunkname >> 16) & 0xFF,
-                (chunkname >> 8) & 0xFF,
-                (chunkname & 0xFF)
-                )
+        return _asciiname(chunkname)
 
 
 class PNGSerializer(serializer.BaseSerializer):
@@ -111,51 +184,134 @@ class PNGSerializer(serializer.BaseSerializer):
             only in IDAT genes is collected in a bytestring and it is compressed
             using the zlib module. Then the compressed bytestring is divided
             again and copied in genes. This functions returns a list with the
-            deflated genes. Keep in mind that this function is working with a
-            deep copy of the genes given as input. Hence, do not worry for your
-            data in the genes passed as argument.
+            deflated genes. Only the IDAT genes, whose data is rewritten,
+            are copied; the other genes are returned as they are, since
+            nothing here touches them. The genes passed as argument are
+            never modified.
         '''
         indices = list()
-        deflated_genes = copy.deepcopy(genes)
-        datastream = str()
+        deflated_genes = list(genes)
+        parts = list()
 
+        # each IDAT payload is fed straight into a streaming
+        # compressor, so the uncompressed stream never has to be
+        # materialized as one big joined buffer beforehand
+        compressor = zlib.compressobj()
         for idx, curr_gene in enumerate(genes):
-            if PNGGene.asciiname(curr_gene.name) == 'IDAT':
+            if curr_gene.name == IDAT_NAME:
                 indices.append(idx)
-                datastream += curr_gene.get_data()
+                # bytes() unifies str and bytearray payloads here
+                parts.append(compressor.compress(
+                    bytes(curr_gene.get_data())))
+        parts.append(compressor.flush())
 
-        comp = zlib.compress(datastream)
+        comp = ''.join(parts)
         idatno = len(indices)
 
         if idatno > 0:
             chunk_len = int(math.ceil(float(len(comp)) / float(idatno)))
 
+            # slice the compressed stream through a memoryview, so the
+            # bytes are copied once into each clone's bytearray rather
+            # than once into a temporary string and again into the gene
+            mv = memoryview(comp)
+
             for cnt, index in enumerate(indices):
                 start = cnt * chunk_len
+                clone = copy.copy(genes[index])
                 if index != indices[-1]:
-                    deflated_genes[index].set_data(
-                            comp[start : start+chunk_len])
+                    clone.set_data(mv[start : start+chunk_len])
                 else:
-                    deflated_genes[index].set_data(
-                            comp[start : ]
-                            )
-                deflated_genes[index].length = len(
-                        deflated_genes[index].get_data()
-                        )
+                    clone.set_data(mv[start : ])
+                clone.length = len(clone.get_data())
+                deflated_genes[index] = clone
 
         return deflated_genes
 
+    @staticmethod
+    def _fix_crcs_parallel(genes):
+        '''
+            recomputes the CRCs of the large chunks on a thread pool
+            before serialization. zlib's crc32 releases the GIL, so the
+            checksums of independent chunks genuinely overlap on
+            multiple cores. Enabled with the ParallelCRC configuration
+            option; chunks below the size threshold stay on the serial
+            path, where the dispatch overhead would dominate.
+        '''
+        config = _get_configuration()
+        if config == None or 'ParallelCRC' not in config \
+                or not config['ParallelCRC']:
+            return
+
+        large = [
+                curr_gene for curr_gene in genes
+                if isinstance(curr_gene, PNGGene) and
+                    len(curr_gene.get_data()) >= _PARALLEL_CRC_THRESHOLD
+                ]
+        if len(large) < 2:
+            return
+
+        def _fix(curr_gene):
+            curr_gene.fix_crc()
+            curr_gene._crc_prefixed = True
+
+        pool = multiprocessing.dummy.Pool(
+                min(multiprocessing.cpu_count(), len(large)))
+        try:
+            pool.map(_fix, large)
+        finally:
+            pool.close()
+            pool.join()
+
+    @staticmethod
+    def _serialize_into(buf, offset, curr_gene):
+        '''
+            writes one chunk (length, name, data, CRC) directly into
+            the output buffer at `offset' and returns the offset right
+            after it.
+        '''
+        if curr_gene._crc_prefixed:
+            curr_gene._crc_prefixed = False
+        else:
+            curr_gene.fix_crc()
+
+        data = curr_gene.get_data()
+        length = len(data)
+        _CHUNK_HDR.pack_into(buf, offset, length, curr_gene.name)
+        buf[offset + 8:offset + 8 + length] = data
+        _U32.pack_into(buf, offset + 8 + length, curr_gene.crc)
+        return offset + 12 + length
+
     def serialize(self, genes):
         '''
             This method serializes each one of the genes given as argument. The
-            serialized bytestring of each of the genes is appended in a buffer
-            that contains the PNG header. The bytestring of the whole PNG
-            is returned.
+            serialized bytestring of each of the genes is written into a
+            single preallocated buffer right after the PNG header, so no
+            intermediate per-chunk bytestrings are built and joined. The
+            bytestring of the whole PNG is returned.
         '''
-        bytestring = PNG_SIGNATURE
         deflated_genes = PNGSerializer.deflate_idat_chunks(genes)
-        bytestring += super(PNGSerializer, self).serialize(deflated_genes)
-        return bytestring
+        PNGSerializer._fix_crcs_parallel(deflated_genes)
+
+        # chunks carrying child genes embed their subtree in the data
+        # field, so their final size is not known up front; those go
+        # through the generic join-based path instead
+        if any(curr_gene.get_children() for curr_gene in deflated_genes):
+            return PNG_SIGNATURE + \
+                    super(PNGSerializer, self).serialize(deflated_genes)
+
+        total = 8 + sum(
+                12 + len(curr_gene.get_data())
+                for curr_gene in deflated_genes
+                )
+        buf = bytearray(total)
+        buf[0:8] = PNG_SIGNATURE
+
+        offset = 8
+        for curr_gene in deflated_genes:
+            offset = PNGSerializer._serialize_into(buf, offset, curr_gene)
+
+        return bytes(buf)
 
 
 class PNGDeserializer(deserializer.BaseDeserializer):
@@ -170,11 +326,13 @@ class PNGDeserializer(deserializer.BaseDeserializer):
     fsize = None
     fstream = None
     chunks = None
+    mm = None
 
     def __init__(self):
         super(PNGDeserializer, self).__init__()
         self.fsize = 0
         self.fstream = None
+        self.mm = None
         self.chunks = list()
 
     def deserialize(self, filename):
@@ -199,7 +357,9 @@ class PNGDeserializer(deserializer.BaseDeserializer):
         for chunk in self.chunks:
             genes.append(PNGGene(chunk))
 
+        self.mm.close()
         self.fstream.close()
+        self.mm = None
         self.fsize = 0
         self.chunks = list()
 
@@ -210,26 +370,48 @@ class PNGDeserializer(deserializer.BaseDeserializer):
             This method takes all IDAT PNG chunks that was read and decompress
             their data using zlib module.
         '''
-        datastream = str()
+        parts = list()
         indices = list()
 
         for idx, chunk in enumerate(self.chunks):
-            if PNGGene.asciiname(chunk['name']) == 'IDAT':
-                datastream += chunk['data']
+            if chunk['name'] == IDAT_NAME:
+                parts.append(chunk['data'])
                 indices.append(idx)
 
-        decomp = zlib.decompress(datastream)
+        # joining once keeps the collection linear; += on a bytestring
+        # re-copies the accumulated stream for every IDAT chunk
+        data = ''.join(parts)
+
+        # libdeflate inflates into a caller-sized buffer, so a bound is
+        # derived from the IHDR dimensions (first chunk by spec): up to
+        # 8 bytes per pixel plus one filter byte per row, with slack.
+        # Anything unexpected falls back to stock zlib.
+        decomp = None
+        if _deflate != None and self.chunks:
+            try:
+                width, height = _CHUNK_HDR.unpack_from(
+                        self.chunks[0]['data'], 0)
+                bound = width * height * 8 + height + 0x10000
+                decomp = _deflate.zlib_decompress(data, bound)
+            except Exception:
+                decomp = None
+        if decomp == None:
+            decomp = zlib.decompress(data)
 
         idatno = len(indices)
         chunk_len = int(math.ceil(float(len(decomp)) / float(idatno)))
 
+        # memoryview slices are zero-copy; the bytes reach their final
+        # buffer only when the gene takes ownership of them
+        mv = memoryview(decomp)
+
         for cnt, index in enumerate(indices):
             start = cnt * chunk_len
 
             if index != indices[-1]:
-                self.chunks[index]['data'] = decomp[start : start + chunk_len]
+                self.chunks[index]['data'] = mv[start : start + chunk_len]
             else:
-                self.chunks[index]['data'] = decomp[start:]
+                self.chunks[index]['data'] = mv[start:]
 
             self.chunks[index]['length'] = len(self.chunks[index]['data'])
 
@@ -238,43 +420,46 @@ class PNGDeserializer(deserializer.BaseDeserializer):
         '''
             The first 8 bytes of every PNG image must be the signature.
         '''
-        signature = self.fstream.read(8)
+        signature = self.mm[0:8]
         assert len(signature) == 8
 
     def _parse_chunks(self):
         '''
             A generator that parses all chunks of the chosen PNG image.
+            The memory-mapped file is indexed directly, so each chunk
+            costs two header unpacks and one data slice instead of
+            four read syscalls.
         '''
+        mm = self.mm
+        size = self.fsize
+        offset = 8
         index = 0
-        while self.fsize > self.fstream.tell():
+        unpack_hdr = _CHUNK_HDR.unpack_from
+        unpack_u32 = _U32.unpack_from
+
+        while offset < size:
             index += 1
             chunk = dict()
             chunk['index'] = index
-            chunk['length'], = struct.unpack('>I', self.fstream.read(4))
-            chunk['name'], = struct.unpack('>I', self.fstream.read(4))
-            chunk['data'] = self.fstream.read(chunk['length'])
-            chunk['crc'], = struct.unpack('>I', self.fstream.read(4))
+            chunk['length'], chunk['name'] = unpack_hdr(mm, offset)
+            data_end = offset + 8 + chunk['length']
+            chunk['data'] = mm[offset + 8:data_end]
+            chunk['crc'], = unpack_u32(mm, data_end)
+            offset = data_end + 4
 
             yield chunk
 
-    def _get_filesize(self):
-        '''
-            Returns the file size.
-        '''
-        where = self.fstream.tell()
-        self.fstream.seek(0, 2)
-        size = self.fstream.tell()
-        self.fstream.seek(where, 0)
-        return size
-
     def _prepare(self, filename):
         '''
-            Preparation before parsing.
+            Preparation before parsing: the file is memory-mapped once
+            and parsed with offset arithmetic.
         '''
         if not os.path.isfile(filename):
             raise IOError('%s is not a regural file.' % filename)
 
         self.chunks = list()
         self.fstream = open(filename, 'rb')
-        self.fsize = self._get_filesize()
+        self.mm = mmap.mmap(self.fstream.fileno(), 0,
+                            access=mmap.ACCESS_READ)
+        self.fsize = len(self.mm)
 
@@ -6,7 +6,5 @@ class BaseSerializer(object):
         pass
 
     def serialize(self, genes):
-        data = ''
-        for gene in genes:
-            data += gene.serialize()
-        return data
+        # one join instead of quadratic += accumulation
+        return ''.join(gene.serialize() for gene in genes)
@@ -15,12 +15,16 @@ class Singleton(type):
         metaclass for any other normal class definition and
         it will become a singleton.
     '''
+    _instances = {}
+
     def __call__(cls, *args, **kwargs):
-        try:
-            return cls.__instance
-        except AttributeError:
-            cls.__instance = super(Singleton, cls).__call__(*args, **kwargs)
-            return cls.__instance
+        # dict fast path; the try/except variant paid for the
+        # exception scaffolding on every instantiation
+        instance = Singleton._instances.get(cls)
+        if instance is None:
+            instance = super(Singleton, cls).__call__(*args, **kwargs)
+            Singleton._instances[cls] = instance
+        return instance
 
 class Configuration(object):
     '''
@@ -35,13 +39,13 @@ class Configuration(object):
 
         self.configfile = os.path.abspath(configfile)
         self.module = self.import_program_as_module('%s' % self.configfile)
+        # the module's names are mirrored in a set, so the frequent
+        # `'X' in config' probes are a hash lookup instead of a
+        # getattr wrapped in try/except
+        self._keys = set(vars(self.module))
 
     def __contains__(self, item):
-        try:
-            getattr(self.module, item)
-            return True
-        except AttributeError:
-            return False
+        return item in self._keys
 
     @contextlib.contextmanager
     def preserve_value(self, namespace, name):
@@ -116,6 +120,7 @@ class Configuration(object):
 
     def __setitem__(self, name, value):
         setattr(self.module, name, value)
+        self._keys.add(name)
 
 
 class ConfigurationError(Exception):
@@ -8,9 +8,35 @@
 '''
 
 import os
+import struct
 import platform
 import subprocess
 
+def _is_64bit(path):
+    '''
+        decides whether the executable at `path' is 64-bit by reading
+        its ELF or PE header directly. platform.architecture() shells
+        out to file(1) for the same answer, which costs a fork+exec
+        per call.
+    '''
+    with open(path, 'rb') as fin:
+        head = fin.read(0x40)
+
+        if head[:4] == '\x7fELF':
+            # EI_CLASS: 1 = 32-bit, 2 = 64-bit
+            return head[4] == '\x02'
+
+        if head[:2] == 'MZ' and len(head) >= 0x40:
+            e_lfanew, = struct.unpack_from('<I', head, 0x3c)
+            fin.seek(e_lfanew)
+            pehdr = fin.read(6)
+            if pehdr[:4] == 'PE\x00\x00':
+                machine, = struct.unpack_from('<H', pehdr, 4)
+                # IMAGE_FILE_MACHINE_AMD64 / _ARM64
+                return machine in (0x8664, 0xAA64)
+
+    return False
+
 class Disassembler(object):
     '''
         This is the disassembler's base class.
@@ -46,11 +72,6 @@ class IDADisassembler(Disassembler):
             platform and target architecture.
         '''
         system = platform.system()
-        # platform.architecture = arch, linkage
-        arch, _ = platform.architecture(
-                exe,
-                bits='64bit'
-                )
 
         runnable = ''
         if system == 'Linux':
@@ -60,7 +81,7 @@ class IDADisassembler(Disassembler):
         else:
             raise OSError('Unsupported system "%s".' % system)
 
-        if arch == '64bit':
+        if _is_64bit(exe):
             runnable += '64'
         if system == 'Windows':
             runnable += '.exe'
@@ -77,21 +98,18 @@ class IDADisassembler(Disassembler):
         scriptcmd = '%s -o %s' % (script, output)
         script = os.path.abspath(script)
 
+        # the arguments are passed as a list, so no shell has to be
+        # spawned to split them and no quoting of the paths is needed
         cmdlist = []
         cmdlist.append(ida) # first argument, ida's path
         cmdlist.append('-A')
-        cmdlist.append('-L"%s"' % os.path.join(output, "log.txt"))
-        cmdlist.append('-S"%s"' % scriptcmd)
+        cmdlist.append('-L%s' % os.path.join(output, "log.txt"))
+        cmdlist.append('-S%s' % scriptcmd)
         cmdlist.append('%s' % exe)
 
         print '[-] command line: ', ' '.join(cmdlist)
 
-        proc = None
-        if platform.system() == 'Linux':
-            proc = subprocess.Popen(' '.join(cmdlist), shell=True)
-        elif platform.system() == 'Windows':
-            proc = subprocess.Popen(' '.join(cmdlist))
-
+        proc = subprocess.Popen(cmdlist)
         proc.wait()
 
     def disassemble(self, blob, output='.'):
@@ -103,6 +121,9 @@ class IDADisassembler(Disassembler):
 
         dump = os.path.join(output, '%s.idmp' % blob)
 
-        with open(dump, 'r') as fin:
+        # the dump holds one record per basic block, so it runs into
+        # the millions of short lines for large targets; a 1 MiB
+        # buffer keeps the read syscall count low
+        with open(dump, 'r', 1 << 20) as fin:
             for line in fin:
                 yield line
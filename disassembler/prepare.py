@@ -9,18 +9,16 @@ import os
 import idc
 import idaapi
 
-def find_functions():
+def find_functions(image_base):
     '''
         yields all functions in the form a 2-tuple:
 
             (function_address, function_name)
 
         function_address is a RELATIVE offset from the
-        image base.
+        image base, which the caller looks up once and
+        passes in.
     '''
-    # get image base from IDA
-    image_base = idaapi.get_imagebase()
-
     # iterate through all functions in the executable.
     for func_ea in Functions(MinEA(), MaxEA()):
         # craft the routine record
@@ -28,7 +26,7 @@ def find_functions():
         funcaddr = func_ea - image_base
         yield funcaddr, func_name
 
-def find_bbls(function_ea):
+def find_bbls(function_ea, image_base):
     '''
         yields all basic blocks that belong to the
         given function. The blocks are returned in
@@ -37,11 +35,9 @@ def find_bbls(function_ea):
             (start_address, end_address)
 
         Both start and end address are RELATIVE offsets
-        from the image base.
+        from the image base, which the caller looks up
+        once and passes in.
     '''
-
-    # get image base from IDA
-    image_base = idaapi.get_imagebase()
     function_ea += image_base
 
     # get flow chart from IDA
@@ -58,9 +54,6 @@ def find_bbls(function_ea):
         if start_addr != end_addr:
             yield start_addr, end_addr
 
-def write(stream, msg):
-    stream.write('%s\n' % msg)
-    stream.flush()
 
 def get_image():
     name = idc.GetInputFile()
@@ -68,30 +61,36 @@ def get_image():
     return base, name
 
 def dump_all(output):
+    # the records are collected in memory and flushed with a single
+    # write; pushing them out line by line made the dump crawl on
+    # large binaries
+    lines = []
+
+    print '[+] Dumping image...'
+    lines.append('##IMAGE##')
+    # the image base is looked up once here; the per-function and
+    # per-block helpers called it through the IDA bridge on every
+    # invocation
+    base, name = get_image()
+    lines.append('%s,%s' % (base, name))
+
+    print '[+] Dumping all functions...'
+    lines.append('##FUNCTIONS##')
+    # materialized so the (expensive) function sweep runs once and
+    # feeds both the function and the basic block sections
+    functions = list(find_functions(base))
+    for fea, fname in functions:
+        lines.append('%s,%s' % (fea, fname))
+
+    print '[+] Dumping all basic blocks...'
+    lines.append('##BBLS##')
+    for fea, fname in functions:
+        for start, end in find_bbls(fea, base):
+            lines.append('0x%x,0x%x,%s' % (start, end, fname))
+
     with open(output, 'w') as fout:
-        print '[+] Dumping image...'
-        write(fout, '##IMAGE##')
-        base, name = get_image()
-        write(fout, '%s,%s' % (base, name))
-
-        print '[+] Dumping all functions...'
-        write(fout, '##FUNCTIONS##')
-        functions = find_functions()
-        for fea, fname in functions:
-            write(fout, '%s,%s' % (fea, fname))
-
-        print '[+] Dumping all basic blocks...'
-        write(fout, '##BBLS##')
-        functions = find_functions()
-        for fea, fname in functions:
-            for start, end in find_bbls(fea):
-                write(
-                        fout, '0x%x,0x%x,%s' % (
-                            start,
-                            end,
-                            fname
-                            )
-                        )
+        fout.write('\n'.join(lines))
+        fout.write('\n')
 
 def wait_until_ready():
     '''
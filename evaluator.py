@@ -4,8 +4,6 @@
     for metric normalization and fitness calculation.
 '''
 
-import sortedcontainers as sc
-
 import configuration
 import campaign
 
@@ -45,18 +43,14 @@ class BasicBlockCoverage(Metric):
         was hit in all images.
     '''
     def get_normal(self, **kwargs):
-        if 'cache' not in kwargs:
+        if 'cache_total' not in kwargs:
             raise KeyError('Cache not found')
 
-        unique_trace = self.chromo.trace.get_unique_total()
-        count = 0x0
-        for img in kwargs['cache']:
-            count += kwargs['cache'][img].get_count()
-
+        count = kwargs['cache_total']
         if count == 0x0:
             return 0.0
 
-        return unique_trace / float(count)
+        return self.chromo.trace.get_unique_total() / float(count)
 
 class UniversalPathUniqueness(Metric):
     '''
@@ -64,49 +58,43 @@ class UniversalPathUniqueness(Metric):
         that was not hit by any other chromosome in the population.
     '''
     def get_normal(self, **kwargs):
-        # assume that this chromosome is in the current generation
-        other = kwargs['previous']
-        this = kwargs['current']
-
-        # check if the assumption is correct
-        if kwargs['previous'] != None:
-            if self.chromo in kwargs['previous']:
-                this = kwargs['previous']
-                other = kwargs['current']
-
-        # holds the unique basic blocks per image (key)
-        unique = {}
-
-        # if other != None, means that this isn't the first generation
-        if other != None:
-            # unique will hold all the bbls that was hit in this chromo
-            # and was not hit by the other generation
-            for img, uniq in self.chromo.trace.get_difference_per_image(
-                    other.trace
-                    ):
-                unique[img] = uniq
+        # the evaluator tags each pass with the generation it walks,
+        # so there is no need to search the previous generation for
+        # this chromosome on every call
+        if kwargs['in_previous']:
+            other = kwargs['current']
+            counts = kwargs['previous_counts']
         else:
-            # if this is the first generation, unique corresponds to
-            # all the bbls of the trace
-            for img in self.chromo.trace.images:
-                unique[img] = sc.SortedSet().update(
-                        self.chromo.trace.set_per_image[img]
-                        )
-        # iterate through all chromos in this generation (unless myself)
-        for chromo in this:
-            if chromo.uid == self.chromo.uid:
-                continue
-            for img in chromo.trace.images:
-                # remove from the unique the bbls that was hit by other
-                # chromosomes in my generation
-                unique[img] -= chromo.trace.set_per_image[img]
-
-        # faults will be equal to the basic blocks that exist only in myself
-        faults = 0x0
-        for img in unique:
-            faults += len(unique[img])
+            other = kwargs['previous']
+            counts = kwargs['current_counts']
 
-        return faults / float(self.chromo.trace.get_unique_total())
+        # an empty trace (the run did not execute anything monitored)
+        # has no unique blocks and must not reach the division below
+        total = self.chromo.trace.get_unique_total()
+        if total == 0x0:
+            return 0.0
+
+        # a basic block is unique to this chromosome when no other
+        # chromosome of its own generation hit it (its count in the
+        # precomputed occurrence table is 1) and the other generation
+        # did not hit it either. The table is built once per
+        # generation by the Evaluator, so this runs in one pass over
+        # the chromosome's own trace instead of subtracting every
+        # other chromosome's trace from it.
+        faults = 0x0
+        for img, bbls in self.chromo.trace.set_per_image.iteritems():
+            img_counts = counts[img]
+            other_set = None
+            if other != None:
+                other_set = other.trace.set_per_image[img]
+            for bbl in bbls:
+                if img_counts[bbl] > 1:
+                    continue
+                if other_set != None and bbl in other_set:
+                    continue
+                faults += 1
+
+        return faults / float(total)
 
 class GenerationUniqueness(Metric):
     '''
@@ -117,28 +105,26 @@ class GenerationUniqueness(Metric):
         # other is `previous' if the chromosome belongs to
         # current generation otherwise it's `current' if the
         # chromosome belongs to previous generation
-        other = kwargs['previous']
-
-        if kwargs['previous'] != None:
-            if self.chromo in kwargs['previous']:
-                other = kwargs['current']
+        if kwargs['in_previous']:
+            other = kwargs['current']
+        else:
+            other = kwargs['previous']
 
         # if other == None, this is the first generation
         if other == None:
             return 1.0
 
-        unique = {}
-
-        for img, uniq in self.chromo.trace.get_difference_per_image(
-                other.trace
-                ):
-            unique[img] = uniq
+        # same zero guard as the other metrics: an empty trace has
+        # nothing unique to offer
+        total = self.chromo.trace.get_unique_total()
+        if total == 0x0:
+            return 0.0
 
-        faults = 0x0
-        for img in unique:
-            faults += len(unique[img])
+        # one fused difference count over all images; no intermediate
+        # per-image difference sets are built
+        faults = self.chromo.trace.difference_count(other.trace)
 
-        return faults / float(self.chromo.trace.get_unique_total())
+        return faults / float(total)
 
 class CodeCommonality(Metric):
     '''
@@ -162,9 +148,20 @@ class Evaluator(object):
     weights = None
     algorithms = None
     population = None
+    _metric_names = None
+    _algo_calls = None
+    _cache_total = None
+    _previous_counts = None
+    _current_counts = None
 
     def __init__(self, cache, configfile=None):
         self.cache = cache
+        # the block cache never changes during a campaign, so its
+        # total block count is summed once here rather than per
+        # chromosome per generation
+        self._cache_total = sum(
+                img.get_count() for img in cache.itervalues()
+                )
         self.configuration = configuration.Configuration(configfile)
         self.campaign = campaign.Campaign()
         self.load_metric_algorithms(
@@ -183,11 +180,47 @@ class Evaluator(object):
         self.algorithms = {}
         for name in algorithms:
             self.algorithms[name] = globals()[name]
-
-    def calculate_metrics(self, chromo):
+        # the metric set is fixed for the whole campaign; every pass
+        # over the metrics below walks this tuple, so all per-metric
+        # tables are visited in one stable order
+        self._metric_names = tuple(self.algorithms)
+        # resolve the calculate entry points once; the per-chromosome
+        # dispatch below is then a plain list walk with direct calls
+        self._algo_calls = [
+                (name, self.algorithms[name].calculate)
+                for name in self._metric_names
+                ]
+
+    @staticmethod
+    def _generation_block_counts(generation):
+        '''
+            counts, per image, in how many chromosomes of the given
+            generation each basic block appears. The uniqueness
+            metrics consult this table instead of re-subtracting every
+            other chromosome's trace for every chromosome, which made
+            the metric pass quadratic in the population size.
+        '''
+        if generation == None:
+            return None
+
+        counts = {}
+        for chromo in generation.get_all():
+            for img, bbls in chromo.trace.set_per_image.iteritems():
+                img_counts = counts.get(img)
+                if img_counts == None:
+                    img_counts = {}
+                    counts[img] = img_counts
+                for bbl in bbls:
+                    img_counts[bbl] = img_counts.get(bbl, 0) + 1
+
+        return counts
+
+    def calculate_metrics(self, chromo, in_previous=False):
         '''
             use the implemented algorithms above to
             calculate the metrics for a given chromosome.
+            in_previous tells the metrics which generation the
+            chromosome belongs to.
         '''
         previous = None
         if self.population.previous != None:
@@ -196,15 +229,17 @@ class Evaluator(object):
         metrics = {}
 
         # This is because we want to log the metrics for each chromosome
-        for name in self.algorithms:
-            algo = self.algorithms[name]
-            metric = algo.calculate(
+        for name, calculate in self._algo_calls:
+            metrics[name] = calculate(
                     chromo,
                     cache=self.cache,
+                    cache_total=self._cache_total,
                     previous=previous,
-                    current=self.population.current
+                    current=self.population.current,
+                    previous_counts=self._previous_counts,
+                    current_counts=self._current_counts,
+                    in_previous=in_previous
                     )
-            metrics[name] = metric
 
         return metrics
 
@@ -217,7 +252,7 @@ class Evaluator(object):
             return
 
         for chromo in self.population.previous.get_all():
-            metrics = self.calculate_metrics(chromo)
+            metrics = self.calculate_metrics(chromo, in_previous=True)
             self.population.previous.set_metrics(chromo.uid, metrics)
 
     def calculate_current_gen_metrics(self):
@@ -236,10 +271,12 @@ class Evaluator(object):
         if self.population.previous == None:
             return self.population.current.max_metrics
 
+        prev = self.population.previous.max_metrics
+        curr = self.population.current.max_metrics
+
         globmax = {}
-        for name, prev in self.population.previous.max_metrics.iteritems():
-            curr = self.population.current.max_metrics[name]
-            globmax[name] = max(prev, curr)
+        for name in self._metric_names:
+            globmax[name] = max(prev[name], curr[name])
 
         return globmax
 
@@ -250,65 +287,37 @@ class Evaluator(object):
         if self.population.previous == None:
             return self.population.current.min_metrics
 
+        prev = self.population.previous.min_metrics
+        curr = self.population.current.min_metrics
+
         globmin = {}
-        for name, prev in self.population.previous.min_metrics.iteritems():
-            curr = self.population.current.min_metrics[name]
-            globmin[name] = min(prev, curr)
+        for name in self._metric_names:
+            globmin[name] = min(prev[name], curr[name])
 
         return globmin
 
-    def get_normalized_metrics(self):
+    def _generation_fitness(self, metrics_table, globmin, maxmin):
         '''
-            normalizes the metrics retrieved for each chromosome
-            in the population (previous AND current generation)
-            using the classical:
+            computes the fitness of every chromosome of one generation
+            in a single pass, fusing the classical normalization
 
                 x_norm = (x - xmin) / (xmax - xmin)
-        '''
-        globmax = self.get_population_max_metrics()
-        globmin = self.get_population_min_metrics()
 
-        maxmin = {}
-        for name in globmax:
-            val = float(globmax[name] - globmin[name])
-            if val == 0.0:
-                maxmin[name] = 1
-            else:
-                maxmin[name] = val
-
-        current = {}
-
-        # this applies to both current and previous
-        # current[chromo.uid][metric_name] = metric_value
-        for chromo in self.population.current.get_all():
-            current[chromo.uid] = {}
-            for name in chromo.metrics:
-                current[chromo.uid][name] = (
-                        chromo.metrics[name] - globmin[name]
-                        ) / maxmin[name]
-
-        previous = {}
-        if self.population.previous != None:
-            for chromo in self.population.previous.get_all():
-                previous[chromo.uid] = {}
-                for name in chromo.metrics:
-                    previous[chromo.uid][name] = (
-                            chromo.metrics[name] - globmin[name]
-                            ) / maxmin[name]
-
-        return previous, current
-
-    def calculate_fitness(self, metrics):
+            with the weighted sum. The per-metric constants are lined
+            up once, so the inner loop reads each metric value exactly
+            once and never builds a normalized copy of the tables.
         '''
-            uses the weights provided in the configuration
-            to calculate the individual fitness of a
-            chromosome.
-        '''
-        fitness = 0.0
-
-        for name in metrics:
-            weight = self.weights[name]
-            fitness += weight * metrics[name]
+        terms = [
+                (name, self.weights[name], globmin[name], maxmin[name])
+                for name in self._metric_names
+                ]
+
+        fitness = {}
+        for uid, metrics in metrics_table.iteritems():
+            value = 0.0
+            for name, weight, gmin, scale in terms:
+                value += weight * (metrics[name] - gmin) / scale
+            fitness[uid] = value
 
         return fitness
 
@@ -320,19 +329,34 @@ class Evaluator(object):
             to set the fitness for every chromosome in
             the population.
         '''
-        previous, current = self.get_normalized_metrics()
+        globmax = self.get_population_max_metrics()
+        globmin = self.get_population_min_metrics()
 
-        self.campaign.log('From the previous generation')
-        for chromo_uid in previous:
-            fitness = self.calculate_fitness(previous[chromo_uid])
-            self.campaign.log('Uid: %s, fitness: %f' % (chromo_uid, fitness))
-            self.population.set_previous_fitness(
-                    chromo_uid, fitness
-                )
+        maxmin = {}
+        for name in globmax:
+            val = float(globmax[name] - globmin[name])
+            if val == 0.0:
+                maxmin[name] = 1
+            else:
+                maxmin[name] = val
+
+        if self.population.previous != None:
+            self.campaign.log('From the previous generation')
+            previous = self._generation_fitness(
+                    self.population.previous.metrics, globmin, maxmin
+                    )
+            for chromo_uid, fitness in previous.iteritems():
+                self.campaign.log(
+                        'Uid: %s, fitness: %f' % (chromo_uid, fitness))
+                self.population.set_previous_fitness(
+                        chromo_uid, fitness
+                    )
 
         self.campaign.log('From the current generation')
-        for chromo_uid in current:
-            fitness = self.calculate_fitness(current[chromo_uid])
+        current = self._generation_fitness(
+                self.population.current.metrics, globmin, maxmin
+                )
+        for chromo_uid, fitness in current.iteritems():
             self.campaign.log('Uid: %s, fitness: %f' % (chromo_uid, fitness))
             self.population.set_fitness(
                     chromo_uid, fitness
@@ -352,6 +376,12 @@ class Evaluator(object):
         '''
         self.campaign.log('Evaluating the population.')
         self.population = population
+        self._previous_counts = self._generation_block_counts(
+                self.population.previous
+                )
+        self._current_counts = self._generation_block_counts(
+                self.population.current
+                )
         self.calculate_previous_gen_metrics()
         self.calculate_current_gen_metrics()
         self.set_population_fitness()
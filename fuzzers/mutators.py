@@ -6,16 +6,16 @@
     and a small integer. Every mutator must return the fuzzed data to the
     caller.
 '''
+import os
 import random
 import re
 
 class Mutator(object):
     '''
-        This is the Mutator base class.
+        This is the Mutator base class. Mutators carry no state: one
+        instance of each is built by the fuzzing strategy when the
+        campaign starts and reused for every mutation after that.
     '''
-    def __init__(self):
-        pass
-
     def mutate(self, data, howmany=0):
         '''
             data is the bytestring that will be mutated. howmany is usually a
@@ -31,21 +31,16 @@ class QuotedTextualNumberMutator(Mutator):
         If there is such a number in the bytestring, it replaces it with a
         value from 0 to 0xFFFFFFFF.
     '''
-    def __init__(self):
-        super(QuotedTextualNumberMutator, self).__init__()
+    # compiled once; the mutator runs for every generation and paid a
+    # cache lookup plus format parse on each call
+    _PATTERN = re.compile('\"\d+\"')
 
     def _coinflip(self, probability):
         ''' returns true with probability 1/probability'''
         return random.randint(0, probability) == 0
 
     def mutate(self, data, attribs=1):
-        pattern = re.compile('\"\d+\"')
-        fuzzed = ''
-        to_be_fuzzed = []
-        matched = []
-
-        for match in pattern.finditer(data):
-            matched.append(match.span())
+        matched = [match.span() for match in self._PATTERN.finditer(data)]
 
         if len(matched) == 0 or attribs == 0:
             return data
@@ -53,30 +48,28 @@ class QuotedTextualNumberMutator(Mutator):
         if len(matched) < attribs:
             attribs = len(matched)
 
-        # first choose randomly which of the matched patterns will be found
-        for _ in xrange(attribs):
-            target = random.choice(matched)
-            to_be_fuzzed.append(target)
-            matched.remove(target)
+        # draw all target spans at once; choosing and removing them
+        # one by one rescanned the list for every pick
+        to_be_fuzzed = sorted(random.sample(matched, attribs))
 
-        # we start to change the matched patterns backwards
-        # otherwise, the indices of to_be_fuzzed variable would need to
-        # recalcuated in every iteration
-        to_be_fuzzed.reverse()
+        # patch the spans in ascending order into a single output
+        # buffer, instead of rebuilding the whole bytestring once per
+        # replacement
+        parts = []
+        position = 0
         for start, end in to_be_fuzzed:
-            fuzzed = '%s\"%d\"%s' % (data[:start],
-                                    random.randint(0, 0xFFFFFFFF),
-                                     data[end:])
-            data = fuzzed
-        return data
+            parts.append(data[position:start])
+            parts.append('\"%d\"' % random.randint(0, 0xFFFFFFFF))
+            position = end
+        parts.append(data[position:])
+
+        return ''.join(parts)
 
 
 class RemoveLines(Mutator):
     '''
         Removes a number of lines.
     '''
-    def __init__(self):
-        super(RemoveLines, self).__init__()
 
     def mutate(self, data, to_be_removed=1):
         lines = data.split('\n')
@@ -84,19 +77,24 @@ class RemoveLines(Mutator):
         if len(lines) < to_be_removed:
             return ''
 
-        for _ in xrange(to_be_removed):
-            line = random.choice(lines)
-            lines.remove(line)
+        # drop distinct positions picked in one draw; choosing a line
+        # and list.remove-ing it rescanned the list per removal and,
+        # with duplicate lines, dropped the first equal line instead
+        # of the chosen one
+        victims = frozenset(
+                random.sample(xrange(len(lines)), to_be_removed)
+                )
 
-        return '\n'.join(lines)
+        return '\n'.join(
+                line for index, line in enumerate(lines)
+                if index not in victims
+                )
 
 
 class RepeatLine(Mutator):
     '''
         Duplicates a line.
     '''
-    def __init__(self):
-        super(RepeatLine, self).__init__()
 
     def mutate(self, data, repeat=1):
         lines = data.split('\n')
@@ -107,8 +105,9 @@ class RepeatLine(Mutator):
         index = random.randint(0, len(lines) - 1)
         target_line = lines[index]
 
-        for _ in xrange(repeat):
-            lines.insert(index, target_line)
+        # one slice assignment; repeated insert() shifts the list tail
+        # once per copy
+        lines[index:index] = [target_line] * repeat
 
         return '\n'.join(lines)
 
@@ -117,20 +116,16 @@ class SwapLines(Mutator):
     '''
         Grabs two lines and swaps them.
     '''
-    def __init__(self):
-        super(SwapLines, self).__init__()
 
     def mutate(self, data, _=1):
         lines = data.split('\n')
         if len(lines) < 2:
             return data
 
-        index1 = random.randint(0, len(lines) - 2)
-        index2 = random.randint(0, len(lines) - 2)
-
-        tmp = lines[index1]
-        lines[index1] = lines[index2]
-        lines[index2] = tmp
+        # two distinct lines; the old bounds excluded the last line
+        # from ever being picked
+        index1, index2 = random.sample(xrange(len(lines)), 2)
+        lines[index1], lines[index2] = lines[index2], lines[index1]
 
         return '\n'.join(lines)
 
@@ -139,19 +134,16 @@ class SwapAdjacentLines(Mutator):
     '''
         Swap two adjacent lines.
     '''
-    def __init__(self):
-        super(SwapAdjacentLines, self).__init__()
 
     def mutate(self, data, howmany=1):
         lines = data.split('\n')
-        if len(lines) < 3:
+        # two adjacent lines are enough to swap
+        if len(lines) < 2:
             return data
 
         for _ in xrange(howmany):
             index = random.randint(0, len(lines) - 2)
-            tmp = lines[index]
-            lines[index] = lines[index + 1]
-            lines[index + 1] = tmp
+            lines[index], lines[index + 1] = lines[index + 1], lines[index]
 
         return '\n'.join(lines)
 
@@ -160,8 +152,6 @@ class PurgeMutator(Mutator):
     '''
         Deletes everything.
     '''
-    def __init__(self):
-        super(PurgeMutator, self).__init__()
 
     def mutate(self, data, _=0):
         return ''
@@ -171,96 +161,79 @@ class SwapByte(Mutator):
     '''
         Grabs two byte randomly and swaps them.
     '''
-    def __init__(self):
-        super(SwapByte, self).__init__()
 
     def mutate(self, data, _=2):
-        fuzzed = ''
-
         if len(data) < 2:
             return data
 
-        rnd1 = random.randint(0, len(data) - 1)
+        buf = bytearray(data)
+
+        rnd1 = random.randint(0, len(buf) - 1)
         if rnd1 >= 1:
             rnd2 = random.randint(0, rnd1 - 1)
-        elif rnd1 + 1 <= len(data) - 1:
-            rnd2 = random.randint(rnd1 + 1, len(data) - 1)
+        elif rnd1 + 1 <= len(buf) - 1:
+            rnd2 = random.randint(rnd1 + 1, len(buf) - 1)
 
-        min_rnd = min(rnd1, rnd2)
-        max_rnd = max(rnd1, rnd2)
+        buf[rnd1], buf[rnd2] = buf[rnd2], buf[rnd1]
 
-        byte1 = data[min_rnd]
-        byte2 = data[max_rnd]
-
-        fuzzed = data[:min_rnd]
-        fuzzed += byte2
-        fuzzed += data[min_rnd + 1:max_rnd]
-        fuzzed += byte1
-        fuzzed += data[max_rnd + 1:]
-
-        return fuzzed
+        return bytes(buf)
 
 
 class SwapWord(Mutator):
     '''
         Grabs two word the swaps them.
     '''
-    def __init__(self):
-        super(SwapWord, self).__init__()
 
     def mutate(self, data, _=4):
-        fuzzed = ''
         if len(data) < 4:
             return data
 
-        rnd1 = random.randint(0, len(data) - 2)
+        buf = bytearray(data)
+
+        rnd1 = random.randint(0, len(buf) - 2)
 
         if rnd1 >= 2:
             rnd2 = random.randint(0, rnd1 - 2)
-        elif rnd1 + 2 <= len(data) - 2:
-            rnd2 = random.randint(rnd1 + 2, len(data) - 2)
+        elif rnd1 + 2 <= len(buf) - 2:
+            rnd2 = random.randint(rnd1 + 2, len(buf) - 2)
         else:
             return data
 
         min_rnd = min(rnd1, rnd2)
         max_rnd = max(rnd1, rnd2)
 
-        word1 = data[min_rnd:min_rnd + 2]
+        # the picks are at least a word apart, so the slices never
+        # overlap and can be exchanged in place
+        buf[min_rnd:min_rnd + 2], buf[max_rnd:max_rnd + 2] = \
+                buf[max_rnd:max_rnd + 2], buf[min_rnd:min_rnd + 2]
 
-        word2 = data[max_rnd:max_rnd + 2]
-
-        fuzzed = data[:min_rnd]
-        fuzzed += word1
-        fuzzed += data[min_rnd + 2:max_rnd]
-        fuzzed += word2
-        fuzzed += data[max_rnd + 2:]
-
-        return fuzzed
+        return bytes(buf)
 
 
 class ByteNullifier(Mutator):
     '''
         Replace one (or more) bytes from the bytestring with \x00.
     '''
-    def __init__(self):
-        super(ByteNullifier, self).__init__()
 
-    def mutate(self, data, _=1):
-        fuzzed = ''
+    def mutate(self, data, howmany=1):
         if len(data) == 0:
             return data
-        index = random.randint(0, len(data) - 1)
 
-        fuzzed = '%s\x00%s' % (data[:index], data[index + 1:])
-        return fuzzed
+        buf = bytearray(data)
+        if howmany > len(buf):
+            howmany = len(buf)
+
+        # all the target positions are drawn at once and patched in
+        # the same buffer
+        for index in random.sample(xrange(len(buf)), howmany):
+            buf[index] = 0x00
+        return bytes(buf)
 
 
 class IncreaseByOneMutator(Mutator):
     '''
         Increases the value of one (or more) byte(s) by one.
     '''
-    def __init__(self):
-        super(IncreaseByOneMutator, self).__init__()
 
     def mutate(self, data, howmany=1):
         if len(data) == 0:
@@ -269,33 +242,18 @@ class IncreaseByOneMutator(Mutator):
         if len(data) < howmany:
             howmany = random.randint(1, len(data))
 
-        fuzzed = data
-
+        buf = bytearray(data)
         for _ in xrange(howmany):
-            index = random.randint(0, len(data) - 1)
-            if ord(data[index]) != 0xFF:
-                fuzzed = '%s%c%s' % (
-                        data[:index],
-                        ord(data[index]) + 1,
-                        data[index + 1:]
-                    )
-            else:
-                fuzzed = '%s\x00%s' % (
-                        data[:index],
-                        data[index + 1:]
-                        )
-                        
-            data = fuzzed
+            index = random.randint(0, len(buf) - 1)
+            buf[index] = (buf[index] + 1) & 0xFF
 
-        return fuzzed
+        return bytes(buf)
 
 
 class DecreaseByOneMutator(Mutator):
     '''
         Decreases the value of one (or more) byte(s) by one.
     '''
-    def __init__(self):
-        super(DecreaseByOneMutator, self).__init__()
 
     def mutate(self, data, howmany=1):
         if len(data) == 0:
@@ -304,22 +262,12 @@ class DecreaseByOneMutator(Mutator):
         if len(data) < howmany:
             howmany = random.randint(0, len(data) - 1)
 
-        fuzzed = data
+        buf = bytearray(data)
         for _ in xrange(howmany):
-            index = random.randint(0, len(data) - 1)
-            if ord(data[index]) != 0:
-                fuzzed = '%s%c%s' % (
-                        data[:index],
-                        ord(data[index]) - 1,
-                        data[index + 1:]
-                    )
-            else:
-                fuzzed = '%s\xFF%s' % (
-                    data[:index],
-                    data[index + 1:]
-                )
-            data = fuzzed
-        return fuzzed
+            index = random.randint(0, len(buf) - 1)
+            buf[index] = (buf[index] - 1) & 0xFF
+
+        return bytes(buf)
 
 
 class ProgressiveIncreaseMutator(Mutator):
@@ -328,23 +276,21 @@ class ProgressiveIncreaseMutator(Mutator):
         Specifically, the first byte will be increased by one, the second by
         two, the third by three and so on.
     '''
-    def __init__(self):
-        super(ProgressiveIncreaseMutator, self).__init__()
 
     def mutate(self, data, howmany=8):
         if len(data) < howmany:
             return data
 
         index = random.randint(0, len(data) - howmany)
-        buf = ''
-        fuzzed = ''
 
-        for addend, curr in enumerate(xrange(index, index + howmany)):
-            if addend + ord(data[curr]) > 0xFF:
-                addend -= 0xFF
-            buf += chr(ord(data[curr]) + addend)
+        # the slice is patched in a bytearray with plain wrap-around
+        # arithmetic; the old loop re-read the input and built the
+        # buffer one chr() concatenation at a time
+        buf = bytearray(data[index:index + howmany])
+        for offset in xrange(howmany):
+            buf[offset] = (buf[offset] + offset + 1) & 0xFF
 
-        fuzzed = '%s%s%s' % (data[index:], buf, data[index + howmany:])
+        fuzzed = '%s%s%s' % (data[:index], bytes(buf), data[index + howmany:])
         return fuzzed
 
 
@@ -354,23 +300,19 @@ class ProgressiveDecreaseMutator(Mutator):
         Specifically, the first byte will be decreased by one, the second by
         two, the third by three and so on.
     '''
-    def __init__(self):
-        super(ProgressiveDecreaseMutator, self).__init__()
 
     def mutate(self, data, howmany=8):
         if len(data) < howmany:
             return data
         index = random.randint(0, len(data) - howmany)
-        buf = ''
-        fuzzed = ''
 
-        for subtrahend, curr in enumerate(xrange(index, index + howmany)):
-            if ord(data[curr]) >= subtrahend:
-                buf += chr(ord(data[curr]) - subtrahend)
-            else:
-                buf += chr(subtrahend - ord(data[curr]))
+        # same in-place scheme as the increase variant, with the
+        # subtrahend wrapping around instead of reflecting
+        buf = bytearray(data[index:index + howmany])
+        for offset in xrange(howmany):
+            buf[offset] = (buf[offset] - offset - 1) & 0xFF
 
-        fuzzed = '%s%s%s' % (data[index:], buf, data[index + howmany:])
+        fuzzed = '%s%s%s' % (data[:index], bytes(buf), data[index + howmany:])
         return fuzzed
 
 
@@ -378,145 +320,125 @@ class SwapDword(Mutator):
     '''
         Grabs two dwords from the bytestring and swaps them.
     '''
-    def __init__(self):
-        super(SwapDword, self).__init__()
 
     def mutate(self, data, _=8):
-        fuzzed = ''
-
         if len(data) < 8:
             return data
 
-        rnd1 = random.randint(0, len(data) - 4)
+        buf = bytearray(data)
+
+        rnd1 = random.randint(0, len(buf) - 4)
 
         if rnd1 >= 4:
             rnd2 = random.randint(0, rnd1 - 4)
-        elif rnd1 + 4 <= len(data) - 4:
-            rnd2 = random.randint(rnd1 + 4, len(data) - 4)
+        elif rnd1 + 4 <= len(buf) - 4:
+            rnd2 = random.randint(rnd1 + 4, len(buf) - 4)
         else:
             return data
 
         min_rnd = min(rnd1, rnd2)
         max_rnd = max(rnd1, rnd2)
 
-        dword1 = data[min_rnd:min_rnd + 4]
-        dword2 = data[max_rnd:max_rnd + 4]
+        # the picks are at least a dword apart, so the slices never
+        # overlap and can be exchanged in place
+        buf[min_rnd:min_rnd + 4], buf[max_rnd:max_rnd + 4] = \
+                buf[max_rnd:max_rnd + 4], buf[min_rnd:min_rnd + 4]
 
-
-        fuzzed = data[:min_rnd]
-        fuzzed += dword1
-        fuzzed += data[min_rnd + 4:max_rnd]
-        fuzzed += dword2
-        fuzzed += data[max_rnd + 4:]
-
-        return fuzzed
+        return bytes(buf)
 
 
 class SetHighBitFromByte(Mutator):
     '''
-        Set the high bit from a byte.
+        Set the high bit from one (or more) byte(s).
     '''
-    def __init__(self):
-        super(SetHighBitFromByte, self).__init__()
 
-    def mutate(self, data, _=1):
-        fuzzed = ''
+    def mutate(self, data, howmany=1):
+        if len(data) == 0:
+            return data
 
-        if len(data) > 0:
-            index = random.randint(0, len(data) - 1)
-            byte = ord(data[index])
-            byte |= 0x80
-            fuzzed = data[:index]
-            fuzzed += chr(byte)
-            fuzzed += data[index + 1:]
+        buf = bytearray(data)
+        if howmany > len(buf):
+            howmany = len(buf)
 
-        return fuzzed
+        for index in random.sample(xrange(len(buf)), howmany):
+            buf[index] |= 0x80
+        return bytes(buf)
 
 
 class DuplicateByte(Mutator):
     '''
         Duplicate randomly a byte (or more) in the bytestring.
     '''
-    def __init__(self):
-        super(DuplicateByte, self).__init__()
 
     def mutate(self, data, howmany=1):
-        fuzzed = ''
+        if len(data) == 0:
+            return data
 
-        if len(data) > howmany:
+        if howmany > len(data):
             howmany = len(data)
 
-        for _ in xrange(howmany):
-            index = random.randint(0, len(data) - 1)
-            byte = data[index]
-            fuzzed = data[:index]
-            fuzzed += byte
-            fuzzed += data[index:]
+        buf = bytearray(data)
+        # the insertion points are drawn once and applied from the
+        # back, so the indices that are still pending stay valid as
+        # the buffer grows
+        for index in sorted(random.sample(xrange(len(buf)), howmany),
+                            reverse=True):
+            buf.insert(index, buf[index])
 
-        return fuzzed
+        return bytes(buf)
 
 
 class RemoveByte(Mutator):
     '''
         Remove randomly a byte (or more) from the bytestring.
     '''
-    def __init__(self):
-        super(RemoveByte, self).__init__()
 
     def mutate(self, data, _=1):
-        fuzzed = data
-        if len(data):
-            index = random.randint(0, len(data))
-            fuzzed = data[:index]
-            fuzzed += data[index + 1:]
-        return fuzzed
+        if not len(data):
+            return data
+
+        buf = bytearray(data)
+        # randint's upper bound is inclusive: an index one past the
+        # end leaves the data untouched, as it always did
+        index = random.randint(0, len(buf))
+        if index < len(buf):
+            del buf[index]
+        return bytes(buf)
 
 
 class RandomByteMutator(Mutator):
     '''
         The old-time classic random byte mutator.
     '''
-    def __init__(self):
-        super(RandomByteMutator, self).__init__()
 
     def mutate(self, data, howmany=5):
         if len(data) < 2:
             return data
-        for _ in xrange(howmany):
-            tmp = random.randint(0, len(data) - 1)
-            data = '%s%c%s' % (
-                    data[:tmp],
-                    random.randint(0, 0xFF),
-                    data[tmp+1:]
-                )
-        return data
+
+        buf = bytearray(data)
+        # all the random byte values come from one urandom call; only
+        # the positions still need the Python-level generator
+        for value in bytearray(os.urandom(howmany)):
+            buf[random.randint(0, len(buf) - 1)] = value
+        return bytes(buf)
 
 
 class AddRandomData(Mutator):
     '''
         Adds some random byte into the bytestring.
     '''
-    def __init__(self):
-        super(AddRandomData, self).__init__()
 
     def mutate(self, data, howmany=2):
-        fuzzed = ''
-        additional = ''
-        for _ in xrange(howmany):
-            additional += '%c' % (random.randint(0, 0xFF))
+        # one urandom call instead of howmany rounds through the
+        # Python random generator
+        additional = os.urandom(howmany)
 
         index = random.randint(0, len(data))
 
-        fuzzed = data[:index]
-        fuzzed += additional
-        fuzzed += data[index:]
-
-        return fuzzed
+        return data[:index] + additional + data[index:]
 
 
 class NullMutator(Mutator):
     '''
         Does absolutely nothing.
     '''
-    def __init__(self):
-        super(NullMutator, self).__init__()
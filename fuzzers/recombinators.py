@@ -7,7 +7,6 @@
     bits and bytes.
 '''
 import random
-import copy
 import fuzzers.mutators as mutators
 
 class Recombinator(object):
@@ -78,31 +77,36 @@ class ChildrenSelector(Recombinator):
     def __init__(self):
         super(ChildrenSelector, self).__init__()
 
-    def choose_genes(self, chr1, chr2):
+    @staticmethod
+    def _choose_child(chromo):
         '''
-            Picks one non-root node from each chromosome/
+            aux: picks one non-root gene of the chromosome uniformly,
+            or None if there is none. The shuffle is an incremental
+            Fisher-Yates that stops at the first non-root hit, so the
+            usual case touches one or two genes instead of shuffling
+            the whole list; the root test is one set probe (genes
+            compare by identity) instead of a scan of the root list.
         '''
         # get_all_genes returns all genes
-        genes1 = chr1.get_all_genes()
+        genes = chromo.get_all_genes()
         # get_genes returns only the root nodes
-        parents1 = chr1.get_genes()
-        child1 = None
-
-        for random_gene in random.sample(genes1, len(genes1)):
-            if random_gene not in parents1:
-                child1 = random_gene
-                break
+        rootids = set(id(gene) for gene in chromo.get_genes())
 
-        genes2 = chr2.get_all_genes()
-        parents2 = chr2.get_genes()
-        child2 = None
+        indices = range(len(genes))
+        for pos in xrange(len(indices)):
+            pick = random.randrange(pos, len(indices))
+            indices[pos], indices[pick] = indices[pick], indices[pos]
+            gene = genes[indices[pos]]
+            if id(gene) not in rootids:
+                return gene
 
-        for random_gene in random.sample(genes2, len(genes2)):
-            if random_gene not in parents2:
-                child2 = random_gene
-                break
+        return None
 
-        return child1, child2
+    def choose_genes(self, chr1, chr2):
+        '''
+            Picks one non-root node from each chromosome/
+        '''
+        return self._choose_child(chr1), self._choose_child(chr2)
 
 
 class SimilarGeneSelector(Recombinator):
@@ -114,11 +118,18 @@ class SimilarGeneSelector(Recombinator):
         super(SimilarGeneSelector, self).__init__()
 
     def choose_genes(self, chr1, chr2):
+        # the second chromosome's genes are indexed by signature, so
+        # each candidate from the first chromosome costs one lookup
+        # instead of a scan over every gene of the second one
+        buckets = chr2.get_gene_buckets()
+        if not buckets:
+            return None, None
+
         genes = chr1.get_all_genes()
         for gene1 in random.sample(genes, len(genes)):
-            for gene2 in chr2.get_all_genes():
-                if gene2.is_equal(gene1):
-                    return gene1, gene2
+            matches = buckets.get(gene1.signature())
+            if matches:
+                return gene1, random.choice(matches)
         return None, None
 
 
@@ -135,10 +146,10 @@ class ParentChildrenSwap(ChildrenSelector, Recombinator):
         if child1 == None or child2 == None:
             return chr1, chr2
 
-        parent1 = chr1.find_parent(child1)
         # index-th position of the parent's children list points to
-        # the selected child. keep this for later
-        index = parent1.children.index(child1)
+        # the selected child; the parent map hands it back together
+        # with the parent, so the siblings are not rescanned for it
+        parent1, index = chr1.find_parent_position(child1)
 
         siblings = parent1.children
         # move the children's ancestors to the parent
@@ -148,8 +159,7 @@ class ParentChildrenSwap(ChildrenSelector, Recombinator):
         child1.children = siblings
         child1.children[index] = parent1
 
-        parent2 = chr2.find_parent(child2)
-        index = parent2.children.index(child2)
+        parent2, index = chr2.find_parent_position(child2)
 
         siblings = parent2.children
         parent2.children = child2.children
@@ -193,8 +203,8 @@ class RandomGeneSwapRecombinator(Recombinator):
             return chr1, chr2
 
         # Probably deep copy is not required here
-        gene1 = copy.deepcopy(old_gene1)
-        gene2 = copy.deepcopy(old_gene2)
+        gene1 = old_gene1.clone()
+        gene2 = old_gene2.clone()
 
         gene1 = self.mutate(gene1, mutator)
         gene2 = self.mutate(gene2, mutator)
@@ -233,8 +243,8 @@ class DuplicateGeneRecombinator(Recombinator):
         if old_gene1 == None or old_gene2 == None:
             return chr1, chr2
 
-        gene1 = copy.deepcopy(old_gene1)
-        gene2 = copy.deepcopy(old_gene2)
+        gene1 = old_gene1.clone()
+        gene2 = old_gene2.clone()
 
         self.mutate(gene1, mutator)
         self.mutate(gene2, mutator)
@@ -268,8 +278,8 @@ class AdditiveSimilarGeneCrossOver(SimilarGeneSelector, Recombinator):
         if old_gene1 == None or old_gene2 == None:
             return chr1, chr2
 
-        gene1 = copy.deepcopy(old_gene1)
-        gene2 = copy.deepcopy(old_gene2)
+        gene1 = old_gene1.clone()
+        gene2 = old_gene2.clone()
 
         self.mutate(gene1, mutator)
         self.mutate(gene2, mutator)
@@ -301,6 +311,25 @@ class SimilarGeneSwapRecombinator(SimilarGeneSelector,
     def __init__(self):
         super(SimilarGeneSwapRecombinator, self).__init__()
 
+    def recombine(self, chr1, chr2, mutator=None):
+        old_gene1, old_gene2 = self.choose_genes(chr1, chr2)
+        if old_gene1 == None or old_gene2 == None:
+            return chr1, chr2
+
+        # the selector only ever pairs up equal genes
+        assert old_gene2.is_equal(old_gene1)
+
+        # the genes are of the same kind, so one fresh copy is
+        # enough: the second chromosome takes a fuzzed clone of the
+        # first gene and the second gene simply moves over to the
+        # first chromosome, instead of both sides paying a clone and
+        # a mutation pass
+        gene1 = self.mutate(old_gene1.clone(), mutator)
+        chr2.replace_gene(old_gene2, gene1)
+        chr1.replace_gene(old_gene1, old_gene2)
+
+        return chr1, chr2
+
 class RandomGeneInsertRecombinator(Recombinator):
     '''
         Chooses a Gene randomly from one chromosome and inserts it
@@ -313,8 +342,8 @@ class RandomGeneInsertRecombinator(Recombinator):
     def recombine(self, chr1, chr2, mutator=None):
         old_gene1, old_gene2 = self.choose_genes(chr1, chr2)
 
-        gene1 = copy.deepcopy(old_gene1)
-        gene2 = copy.deepcopy(old_gene2)
+        gene1 = old_gene1.clone()
+        gene2 = old_gene2.clone()
 
         gene1 = self.mutate(gene1, mutator)
         gene2 = self.mutate(gene2, mutator)
@@ -12,26 +12,52 @@ class WeightedSelector(world.NaiveSelector):
         to select it or not.
     '''
     def __init__(self, objlist, initial=0):
-        super(WeightedSelector, self).__init__(objlist)
+        super(WeightedSelector, self).__init__(objlist, initial)
+        # the weights live in a list parallel to the key table of the
+        # base class; a key resolves to its slot through objindex
+        self.weights = [initial] * len(self.objkeys)
+        self._cumulative = None
+
+    def _rebuild_distribution(self):
+        '''
+            aux: running sum of the selection odds, in key table
+            order. The rejection loop picked a key uniformly and kept
+            it with probability 1/(weight + 1), so a key's share of
+            the draws is proportional to 1/(weight + 1); the
+            cumulative table below encodes exactly that distribution
+            and one bisect resolves a draw without any retries.
+        '''
+        self._cumulative = []
+        running = 0.0
+        for weight in self.weights:
+            running += 1.0 / (weight + 1)
+            self._cumulative.append(running)
 
     def select(self):
         '''
             selects a random object from the object list
             based according to weights set.
         '''
-        if not self.objdict.keys():
+        if not self.objkeys:
             return None
 
-        while True:
-            objkey = random.choice(self.objdict.keys())
-            if self.unfair_coinflip(self.objdict[objkey]):
-                return objkey
+        if self._cumulative == None:
+            self._rebuild_distribution()
+
+        ticket = random.uniform(0.0, self._cumulative[-1])
+        index = bisect.bisect(self._cumulative, ticket)
+        if index == len(self.objkeys):
+            index -= 1
+        return self.objkeys[index]
 
     def set_weight(self, key, weight):
-        self.objdict[key] = weight
+        self.weights[self.objindex[key]] = weight
+        # the cached distribution no longer matches the weights; it is
+        # rebuilt lazily on the next draw
+        self._cumulative = None
 
     def get_weight(self, key):
-        return self.objdict[key]
+        return self.weights[self.objindex[key]]
 
 class Lottery(object):
     '''
@@ -71,20 +97,91 @@ class Lottery(object):
         return self.players[index-1]
 
     @classmethod
-    def run(cls, players):
+    def build(cls, players):
         '''
-            players is an iterable of
+            builds a lottery with one ticket batch per player, taking
+            each player's score as its ticket count. The instance can
+            be kept around and asked for any number of winners, so the
+            cumulative ticket table is paid for once per change of the
+            scores instead of once per draw.
         '''
         obj = cls()
         for player in players:
             obj.join(player, player['score'])
-        return obj.choose_winner()
+        return obj
+
+    @classmethod
+    def run(cls, players):
+        '''
+            players is an iterable of
+        '''
+        return cls.build(players).choose_winner()
+
+class AliasSampler(object):
+    '''
+        Walker's alias method for drawing from a fixed weighted set.
+        Setup splits the probability mass into one bucket per player,
+        each holding at most two players, so a draw costs one random
+        index plus one biased coinflip no matter how many players
+        there are -- where the lottery's bisect grows with the log of
+        the player count.
+    '''
+    players = None
+    _prob = None
+    _alias = None
+
+    def __init__(self, players, weights):
+        self.players = players
+
+        count = len(players)
+        scale = count / float(sum(weights))
+        scaled = [weight * scale for weight in weights]
+
+        small = []
+        large = []
+        for index in xrange(count):
+            if scaled[index] < 1.0:
+                small.append(index)
+            else:
+                large.append(index)
+
+        prob = [1.0] * count
+        alias = range(count)
+        while small and large:
+            low = small.pop()
+            high = large.pop()
+            prob[low] = scaled[low]
+            alias[low] = high
+            scaled[high] -= 1.0 - scaled[low]
+            if scaled[high] < 1.0:
+                small.append(high)
+            else:
+                large.append(high)
+
+        self._prob = prob
+        self._alias = alias
+
+    def draw(self):
+        '''
+            returns one player, with probability proportional to its
+            weight.
+        '''
+        index = random.randrange(len(self.players))
+        if random.random() < self._prob[index]:
+            return self.players[index]
+        return self.players[self._alias[index]]
 
 class FuzzingStrategy(object):
     configuration = None
     recombinators = None
     mutators = None
     candidates = None
+    # the candidate set is fixed after generate_candidates; this
+    # tuple is the stable draw order for the lottery below
+    _cands = None
+    # lazily built alias sampler over the candidates; good/bad drop
+    # it so the tables are only rebuilt when a score actually changed
+    _sampler = None
 
     def __init__(self):
         self.configuration = Configuration()
@@ -119,17 +216,27 @@ class FuzzingStrategy(object):
                 candidate['mutator'] = mutator
                 candidate['score'] = 0x1
                 self.candidates[cid] = candidate
+        self._cands = tuple(self.candidates.itervalues())
 
     def good(self, cid, score=1):
         this = self.candidates[cid]['score']
         self.candidates[cid]['score'] = max(this, score)
+        self._sampler = None
 
     def bad(self, cid, score=1):
         if self.candidates[cid]['score'] > 1:
             self.candidates[cid]['score'] -= score
+            self._sampler = None
 
     def select_candidate(self):
-        return Lottery.run(self.candidates.values())
+        # the candidate scores only move through good/bad, so between
+        # those calls every selection reuses the same sampler tables
+        if self._sampler == None:
+            self._sampler = AliasSampler(
+                    self._cands,
+                    [candidate['score'] for candidate in self._cands]
+                    )
+        return self._sampler.draw()
 
     def recombine(self, male, female):
         candidate = self.select_candidate()
@@ -146,6 +253,11 @@ class FuzzingStrategy(object):
                 mutator
                 )
 
+        # the recombinator and the mutator patch the genes directly,
+        # so drop whatever the chromosomes have memoized about them
+        son.invalidate()
+        daughter.invalidate()
+
         son.fuzzer = candidate['cid']
         daughter.fuzzer = candidate['cid']
 
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+'''
+    Builds the optional native accelerators. Choronzon runs fine
+    without them; the importing modules fall back to their pure Python
+    versions when an extension is missing.
+
+        python setup.py build_ext --inplace
+
+    The gene tree walk accelerator additionally needs Cython at build
+    time; it is skipped silently when Cython is not installed.
+'''
+
+from distutils.core import setup, Extension
+
+ext_modules = [
+        Extension(
+            '_blockcache',
+            ['_blockcache.c'],
+            extra_compile_args=['-O3'],
+            )
+        ]
+
+try:
+    from Cython.Build import cythonize
+    ext_modules += cythonize([
+            Extension(
+                'chromosome._gene',
+                ['chromosome/_gene.pyx'],
+                extra_compile_args=['-O3'],
+                )
+            ])
+except ImportError:
+    pass
+
+setup(
+        name='choronzon-accel',
+        version='0.1',
+        description='native accelerators for the Choronzon fuzzer',
+        ext_modules=ext_modules,
+        )
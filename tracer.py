@@ -1,8 +1,8 @@
 #!/usr/bin/env python
 
 import os
+import mmap
 import struct
-import sortedcontainers as sc
 import settings
 
 import campaign
@@ -19,6 +19,9 @@ class Trace(object):
     trace = None
     total = None
     has_crashed = None
+    # memoized unique block count; a trace is only ever mutated while
+    # it is being built, after which every metric re-reads this
+    _unique_total = None
 
     def __init__(self):
         self.has_crashed = False
@@ -33,7 +36,9 @@ class Trace(object):
         '''
         self.images.append(image)
         #self.bbls_per_image[image] = []
-        self.set_per_image[image] = sc.SortedSet()
+        # a plain set: the consumers only ever test membership and
+        # take differences, so the sorted order was pure overhead
+        self.set_per_image[image] = set()
 
     def add_bbl(self, image, bbl):
         '''
@@ -45,6 +50,38 @@ class Trace(object):
         #self.bbls_per_image[image].append(bbl)
         self.set_per_image[image].add(bbl)
         self.total += 1
+        self._unique_total = None
+
+    def add_bbls(self, image, bbls):
+        '''
+            Adds a batch of basic blocks into the trace with a single
+            set update. Like add_bbl, the blocks are counted towards
+            the total once per hit, duplicates included.
+        '''
+        self.set_per_image[image].update(bbls)
+        self.total += len(bbls)
+        self._unique_total = None
+
+    def get_state(self):
+        '''
+            Returns the trace as a plain tuple of builtins, suitable
+            for marshal. The dump side of the chromosome store uses
+            this instead of pickling the Trace object, since marshal
+            handles the image lists and the basic block sets natively
+            and considerably faster.
+        '''
+        return (self.images, self.set_per_image, self.total,
+                self.has_crashed)
+
+    @classmethod
+    def from_state(cls, state):
+        '''
+            Rebuilds a Trace from a tuple produced by get_state.
+        '''
+        trace = cls()
+        (trace.images, trace.set_per_image, trace.total,
+                trace.has_crashed) = state
+        return trace
 
     def get_total(self):
         '''
@@ -55,12 +92,16 @@ class Trace(object):
     def get_unique_total(self):
         '''
             Returns the total number of unique basic blocks
-            of all images, hit by the current trace.
+            of all images, hit by the current trace. The count is
+            computed once and remembered; every metric asks for it
+            on every generation.
         '''
-        count = 0x0
-        for img in self.set_per_image:
-            count += len(self.set_per_image[img])
-        return count
+        if self._unique_total == None:
+            count = 0x0
+            for img in self.set_per_image:
+                count += len(self.set_per_image[img])
+            self._unique_total = count
+        return self._unique_total
 
     def get_difference_per_image(self, trace):
         '''
@@ -74,19 +115,30 @@ class Trace(object):
             other = trace.set_per_image[img]
             yield img, this - other
 
-    def get_similarity(self, trace):
+    def difference_count(self, trace):
         '''
-            Returns the percentage of similar basic block between two traces.
-            If the return value is 1.0, the traces are equal. On the other hand,
-            if it is 0.0, the traces have not any common basic block.
+            Returns the number of basic blocks of this trace that the
+            given trace did not hit, over all images, without
+            materializing the per-image difference sets.
         '''
         assert len(self.set_per_image) == len(trace.set_per_image)
         faults = 0x0
         for img in self.images:
             this = self.set_per_image[img]
             other = trace.set_per_image[img]
-            faults += len(this - other)
-        return faults / float(self.get_unique_total())
+            # len(this) - |intersection| equals |this - other| but
+            # the scratch set it builds is bounded by the smaller of
+            # the two traces instead of by this one
+            faults += len(this) - len(this & other)
+        return faults
+
+    def get_similarity(self, trace):
+        '''
+            Returns the percentage of similar basic block between two traces.
+            If the return value is 1.0, the traces are equal. On the other hand,
+            if it is 0.0, the traces have not any common basic block.
+        '''
+        return self.difference_count(trace) / float(self.get_unique_total())
 
     def update(self, trace):
         '''
@@ -97,6 +149,66 @@ class Trace(object):
                 self.add_image(img)
             self.set_per_image[img].update(trace.set_per_image[img])
             self.total += trace.total
+        self._unique_total = None
+
+class GlobalCoverage(object):
+    '''
+        A coverage bitmap shared between Choronzon instances through a
+        memory-mapped file in the shared directory. Every basic block
+        known from the disassembly gets one bit; merging a trace ORs
+        its bits in and reports whether any of them was new. Racing
+        instances can only ever set bits, so a lost update at worst
+        makes a chromosome get dumped twice, which the importing side
+        already tolerates.
+    '''
+    bits_per_image = None
+    shared = None
+
+    def __init__(self, path, cache):
+        # assign a stable bit position to every known basic block;
+        # all instances derive the same layout from the disassembly
+        self.bits_per_image = {}
+        offset = 0x0
+        for image in sorted(cache):
+            index = {}
+            for start in sorted(cache[image].cache):
+                index[start] = offset
+                offset += 1
+            self.bits_per_image[image] = index
+
+        size = max((offset + 7) >> 3, 1)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self.shared = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def merge(self, trace):
+        '''
+            ORs the basic blocks of the trace into the shared bitmap.
+            Returns True if at least one of them had not been seen by
+            any instance before.
+        '''
+        new = False
+        shared = self.shared
+
+        for image, bbls in trace.set_per_image.iteritems():
+            index = self.bits_per_image.get(image)
+            if index == None:
+                continue
+            for bbl in bbls:
+                bit = index.get(bbl[0])
+                if bit == None:
+                    continue
+                mask = 1 << (bit & 7)
+                old = ord(shared[bit >> 3])
+                if not old & mask:
+                    shared[bit >> 3] = chr(old | mask)
+                    new = True
+
+        return new
 
 class Tracer(object):
     cache = None
@@ -104,6 +216,9 @@ class Tracer(object):
     analyzer = None
     disassembler = None
     configuration = None
+    command = None
+    whitelist = None
+    shared_coverage = None
 
     def __init__(self, configfile=None):
         self.cache = {}
@@ -142,6 +257,24 @@ class Tracer(object):
             print '    [-] Disassemblying %s...' % (os.path.basename(exe))
             self.disassemble(exe)
 
+        # everything that is invariant across runs is resolved once
+        # here rather than per analyzed seed
+        self.command = self.configuration['Command']
+        self.whitelist = self.configuration['Whitelist']
+        os.chdir(self.campaign.campaign_dir)
+
+        # when several instances cooperate through a shared directory,
+        # they also share a coverage bitmap living next to the dumps
+        self.shared_coverage = None
+        if 'ChromosomeShared' in self.configuration:
+            shared = self.configuration['ChromosomeShared']
+            if not os.path.exists(shared):
+                os.makedirs(shared)
+            self.shared_coverage = GlobalCoverage(
+                    os.path.join(shared, 'coverage.map'),
+                    self.cache
+                    )
+
     def disassemble(self, exe):
         '''
             Disassembles the binary and imports the basic block
@@ -181,26 +314,53 @@ class Tracer(object):
             raised in the monitored application.
         '''
         trace = Trace()
-        nimg = 0x0
+        # the whole stream is drained in fixed 64 KiB reads and glued
+        # together once, then decoded from memory; the trace arrives
+        # over a named pipe in bursts, so the fixed-size reads match
+        # the producer's pace without repeatedly regrowing one buffer
         with open(trace_file, 'rb') as fin:
-            nimg = ord(fin.read(1))
-            # read the image section
-            for _ in xrange(nimg):
-                imgname_sz, = struct.unpack('<H', fin.read(2))
-                image_name = fin.read(imgname_sz)
-                trace.add_image(os.path.basename(image_name))
-            # read the basic block section
-            buf = fin.read(16)
-            while buf:
-                ino, bbl = struct.unpack('<QQ', buf)
-                if ino == 0xffffffffffffffffL:
-                    if bbl != 0xC:
-                        trace.has_crashed = True
-                else:
-                    bbl = self.cache[trace.images[ino]].get_cached(bbl)
-                    if bbl != None:
-                        trace.add_bbl(trace.images[ino], bbl)
-                buf = fin.read(16)
+            data = ''.join(iter(lambda: fin.read(1 << 16), ''))
+
+        # decode the image section by walking an offset over the
+        # buffer
+        nimg = ord(data[0])
+        position = 1
+        unpack_len = struct.Struct('<H').unpack_from
+        for _ in xrange(nimg):
+            imgname_sz, = unpack_len(data, position)
+            position += 2
+            image_name = data[position:position + imgname_sz]
+            position += imgname_sz
+            trace.add_image(os.path.basename(image_name))
+
+        # one bucket per image, indexed by the record's image
+        # number; binding the append methods up front leaves a
+        # single list index and call per record in the hot loop
+        offsets_per_image = [[] for _ in xrange(nimg)]
+        appends = [bucket.append for bucket in offsets_per_image]
+
+        unpack_from = struct.Struct('<QQ').unpack_from
+        limit = len(data) - 15
+        while position < limit:
+            ino, bbl = unpack_from(data, position)
+            position += 16
+            if ino == 0xffffffffffffffffL:
+                if bbl != 0xC:
+                    trace.has_crashed = True
+            else:
+                appends[ino](bbl)
+
+        # translate the raw offsets through each image's block cache
+        # and push them into the trace one batch per image
+        for ino, offsets in enumerate(offsets_per_image):
+            if not offsets:
+                continue
+            image = trace.images[ino]
+            get_cached = self.cache[image].get_cached
+            trace.add_bbls(image, [
+                    bbl for bbl in map(get_cached, offsets)
+                    if bbl != None
+                    ])
 
         self.campaign.delete_pipe(trace_file)
         return trace
@@ -209,12 +369,16 @@ class Tracer(object):
         '''
             Grabs a seed from the corpus, executes the application using
             the analyzer module and returns the trace.
+
+            Each run still pays for a pin startup: the coverage pintool
+            instruments one process per seed and reports over a fresh
+            pipe, so a persistent (fork-server style) target would need
+            support on the pintool side first. The Python side of the
+            run path is kept free of per-run setup instead.
         '''
         path = self.campaign.get(seedid)
         output = self.campaign.create_pipe('%s.dmp' % seedid)
-        cmd = self.configuration['Command'] % path
-        os.chdir(self.campaign.campaign_dir)
-        dmp = self.analyzer.run(execmd=cmd, output=output,
-                                whitelist=self.configuration['Whitelist'])
+        dmp = self.analyzer.run(execmd=self.command % path, output=output,
+                                whitelist=self.whitelist)
         return self.parse_trace_file(dmp)
 
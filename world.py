@@ -3,6 +3,10 @@
     population.
 '''
 import random
+import array
+import bisect
+import collections
+from multiprocessing.pool import ThreadPool
 import tracer
 
 import campaign
@@ -26,35 +30,65 @@ class NaiveSelector(object):
             return False
 
     def __init__(self, whatever, initial=0):
-        # key is the identification of a chromosome
-        # value is the number of the times that has been selected.
-        self.objdict = dict(map(lambda filename: (filename, initial), whatever))
+        # static key table plus a parallel machine-word count array:
+        # the key set never changes after construction, and a packed
+        # array keeps the per-entry footprint to one integer instead
+        # of a dict slot, while is_done scans it at C speed.
+        self.objkeys = list(whatever)
+        self.objindex = dict(
+                (key, index) for index, key in enumerate(self.objkeys)
+                )
+        self.counts = array.array('l', [initial] * len(self.objkeys))
 
     def is_done(self):
         '''
             Returns True if all chromosomes has been selected at least once.
         '''
-        done = True
-        if 0 in self.objdict.values():
-            done = False
-        return done
+        return 0 not in self.counts
+
+    def remaining(self):
+        '''
+            Returns the number of chromosomes that have never been
+            selected so far.
+        '''
+        return sum(1 for count in self.counts if count == 0)
 
     def select(self):
         '''
             Selects a chromosome and returns its identification.
             The probability for selecting a chromosome is inversely proportional
             to the times that it already had been selected.
+
+            One draw resolves against the cumulative distribution of
+            the selection odds, so the cost is a single pass plus a
+            bisect instead of a rejection loop whose expected length
+            grows with the selection counts. The odds per key are
+            1/(count + 1), exactly what the old biased-coin acceptance
+            gave each key.
         '''
-        done = False
+        counts = self.counts
 
-        while not done:
-            objkey = random.choice(self.objdict.keys())
-            done = self.unfair_coinflip(self.objdict[objkey])
+        cumulative = []
+        total = 0.0
+        for count in counts:
+            total += 1.0 / (count + 1)
+            cumulative.append(total)
+
+        index = bisect.bisect(cumulative, random.uniform(0.0, total))
+        if index == len(counts):
+            index -= 1
+
+        counts[index] += 1
 
-        self.objdict[objkey] += 1
+        return self.objkeys[index]
 
-        return objkey
 
+# read-only view of a chromosome for consumers that never touch the
+# genes; see Generation.load_light
+LightChromosome = collections.namedtuple(
+        'LightChromosome',
+        ('uid', 'fitness', 'metrics', 'trace')
+        )
 
 class Generation(object):
     '''
@@ -68,6 +102,16 @@ class Generation(object):
     chromosomes = None
     selector = None
     campaign = None
+    fitness = None
+    metrics = None
+    # bounded LRU of deserialized chromosomes keyed by uid; almost
+    # every consumer asks for the same uids several times per epoch,
+    # and each miss costs a disk read plus an unpickle
+    _cache = None
+    _CACHE_CAP = 128
+    # uids whose cached object is newer than its campaign file; the
+    # pickle write-back is deferred to flush() or to eviction
+    _dirty = None
 
     def __init__(self, epoch=0):
         self.campaign = campaign.Campaign()
@@ -79,6 +123,14 @@ class Generation(object):
         self.trace = tracer.Trace()
         self.max_metrics = dict()
         self.min_metrics = dict()
+        # per-uid tables of the fitness and the metrics, mirroring the
+        # values stored inside the pickled chromosomes. Consumers that
+        # only need those numbers can read them from here without
+        # unpickling whole chromosomes.
+        self.fitness = dict()
+        self.metrics = dict()
+        self._cache = collections.OrderedDict()
+        self._dirty = set()
 
     def __iter__(self):
         for key in self.chromosomes:
@@ -111,19 +163,144 @@ class Generation(object):
                 )
 
         self.chromosomes[uid] = path
+        self.fitness[uid] = chromo.fitness
+        self.metrics[uid] = chromo.metrics
+        # the live object is the freshest view of what was just
+        # written through; keep it so the next get does not unpickle
+        # what this process already holds
+        self._cache_store(uid, chromo)
+        self._dirty.discard(uid)
         return path
 
+    def _cache_store(self, uid, chromo):
+        '''
+            aux: (re)files the chromosome in the LRU cache, evicting
+            the least recently used entry beyond the cap. An entry
+            with a pending write-back is persisted on its way out.
+        '''
+        self._cache.pop(uid, None)
+        self._cache[uid] = chromo
+        while len(self._cache) > self._CACHE_CAP:
+            olduid, oldchromo = self._cache.popitem(last=False)
+            if olduid in self._dirty:
+                self._write_back(olduid, oldchromo)
+
+    def _write_back(self, uid, chromo):
+        '''
+            aux: pickles the chromosome into the campaign store and
+            syncs the per-uid tables; clears its pending flag.
+        '''
+        self.chromosomes[uid] = self.campaign.add_chromosome(
+                uid,
+                chromo.dumps_chromosome()
+                )
+        self.fitness[uid] = chromo.fitness
+        self.metrics[uid] = chromo.metrics
+        self._dirty.discard(uid)
+
+    def update_chromosome(self, uid, chromo):
+        '''
+            Records a mutation of an already stored chromosome without
+            pickling it back immediately. The cached object is the
+            authoritative copy until flush() (or an eviction) writes
+            it through; consumers keep reading it via get_chromosome
+            in the meantime.
+        '''
+        self._cache_store(uid, chromo)
+        self._dirty.add(uid)
+
+    # file writes of one flush in flight at a time; the step they
+    # overlap is disk I/O, so a handful of threads is enough
+    _FLUSH_WORKERS = 4
+
+    def flush(self):
+        '''
+            writes every deferred chromosome mutation back to the
+            campaign store. Called when the generation is rotated out,
+            so per-attribute updates like the fitness pass cost one
+            pickle per chromosome per epoch instead of one per update.
+
+            The serialization stays on the calling thread -- the
+            module-level pickler the dumps go through is reused state
+            -- but the hash-and-write step of each store is fanned out
+            over a small thread pool: both hashing and the raw fd
+            write drop the GIL, so the flush overlaps the disk instead
+            of waiting on one file at a time.
+        '''
+        pending = []
+        for uid in list(self._dirty):
+            chromo = self._cache.get(uid)
+            if chromo != None:
+                pending.append((uid, chromo, chromo.dumps_chromosome()))
+
+        def _store(item):
+            uid, _, blob = item
+            return uid, self.campaign.add_chromosome(uid, blob)
+
+        if len(pending) > 1:
+            pool = ThreadPool(min(self._FLUSH_WORKERS, len(pending)))
+            try:
+                stored = pool.map(_store, pending)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            stored = map(_store, pending)
+
+        for uid, path in stored:
+            self.chromosomes[uid] = path
+
+        for uid, chromo, _ in pending:
+            self.fitness[uid] = chromo.fitness
+            self.metrics[uid] = chromo.metrics
+
+        self._dirty.clear()
+
     def get_chromosome(self, uid):
         '''
             instantiates the factory class in order to build a new
             and empty chromosome which is then loaded from a saved
             pickle object inside the campaign. The new chromosome is
-            returned.
+            returned. Recently used chromosomes are served from an
+            in-memory cache instead of being unpickled from the
+            campaign again; callers that mutate the result still have
+            to persist it with set_chromosome, as they always had to.
         '''
+        chromo = self._cache.pop(uid, None)
+        if chromo != None:
+            # refresh the LRU position
+            self._cache[uid] = chromo
+            return chromo
+
         empty = chromosome.Factory.build_empty()
         empty.load_chromosome(self.campaign.get_chromosome(uid))
+        self._cache_store(uid, empty)
         return empty
 
+    def load_light(self, uid):
+        '''
+            Returns a LightChromosome view of the chromosome: its uid,
+            fitness, metrics and trace, but not its genes. A cached
+            chromosome lends its live attributes; for anything else
+            only the marshalled head of the campaign file is read, so
+            the pickled gene tree is neither read nor decoded.
+        '''
+        chromo = self._cache.get(uid)
+        if chromo != None:
+            return LightChromosome(
+                    uid, chromo.fitness, chromo.metrics, chromo.trace)
+
+        metrics, _, trace = chromosome.load_light(self.chromosomes[uid])
+        return LightChromosome(uid, self.fitness.get(uid), metrics, trace)
+
+    def iter_light(self):
+        '''
+            Yields a light view of every chromosome in the generation;
+            see load_light.
+        '''
+        for uid in self.chromosomes:
+            yield self.load_light(uid)
+
     def delete_chromosome(self, uid):
         '''
             delete the chromsome corresponding to the given uid from
@@ -132,6 +309,10 @@ class Generation(object):
         chromo = self.get_chromosome(uid)
         self.campaign.delete_chromosome(uid)
         del self.chromosomes[uid]
+        self.fitness.pop(uid, None)
+        self.metrics.pop(uid, None)
+        self._cache.pop(uid, None)
+        self._dirty.discard(uid)
         return chromo
 
     def delete(self, uid):
@@ -159,23 +340,25 @@ class Generation(object):
             has been assigned to the current generation. When the selector
             is finished, it returns None.
         '''
-        try:
-            if self.selector.is_done():
-                return None
-        except AttributeError:
-            self.selector = NaiveSelector(
-                    self.chromosomes.keys()
-                    )
+        if self.selector == None:
+            # the selector copies the uids into its own key table, so
+            # there is no need to materialize a keys list here first
+            self.selector = NaiveSelector(self.chromosomes)
+
+        if self.selector.is_done():
+            return None
 
         return self.get_chromosome(self.selector.select())
 
     def set_fitness(self, uid, fitness):
         '''
-            Sets the fitness of a specific chromosome.
+            Sets the fitness of a specific chromosome. The write-back
+            of the pickled form is deferred; see update_chromosome.
         '''
         chromo = self.get_chromosome(uid)
         chromo.fitness = fitness
-        self.set_chromosome(chromo.uid, chromo)
+        self.fitness[uid] = fitness
+        self.update_chromosome(uid, chromo)
 
     def clear_metrics(self):
         self.max_metrics = {}
@@ -189,7 +372,8 @@ class Generation(object):
 
         chromo = self.get_chromosome(uid)
         chromo.set_metrics(metrics)
-        self.set_chromosome(uid, chromo)
+        self.metrics[uid] = metrics
+        self.update_chromosome(uid, chromo)
 
         for name in metrics:
             if name not in self.max_metrics \
@@ -226,15 +410,15 @@ class Population(object):
         self.previous = None
         self.current = Generation(self.epoch)
 
-        # Setup image leaders and basic blocks leaders
+        # Setup image leaders and basic blocks leaders. The per-image
+        # tables are sparse: a basic block gets an entry the first
+        # time some trace covers it, so the footprint follows the
+        # coverage instead of one slot for every block of the
+        # disassembly, most of which no run ever reaches.
         self.image_leaders = {}
 
         for image_name in self.cache:
             self.image_leaders[image_name] = {}
-            bbl_leaders = {}
-            for startea in self.cache[image_name].yield_bbls():
-                bbl_leaders[startea] = None
-            self.image_leaders[image_name] = bbl_leaders
 
     def get_chromo_from_current(self, uid):
         '''
@@ -284,6 +468,15 @@ class Population(object):
 
         while not done:
             male = self.current.select()
+
+            # once nothing unselected remains, every further draw can
+            # only repeat seen chromosomes until the selector reports
+            # done; stop here instead of respinning for a different
+            # mate that may never come
+            if different and male != None \
+                    and self.current.selector.remaining() == 0:
+                break
+
             female = self.current.select()
 
             if different:
@@ -307,6 +500,12 @@ class Population(object):
 
         while not done:
             male = self.previous.select()
+
+            # see get_couple_from_current for the early exit
+            if different and male != None \
+                    and self.previous.selector.remaining() == 0:
+                break
+
             female = self.previous.select()
 
             if different:
@@ -326,6 +525,12 @@ class Population(object):
             Returns the current generation.
         '''
         self.epoch += 1
+        # persist the deferred mutations of the outgoing generations;
+        # past this point their campaign files may be read by other
+        # instances or a later import
+        if self.previous != None:
+            self.previous.flush()
+        self.current.flush()
         self.previous = self.current
 
         if newgen == None:
@@ -336,11 +541,13 @@ class Population(object):
         return self.current
 
     def does_exist(self, uid):
-        exists = False
-        if self.get_chromo_from_current(uid) != None \
-            or self.get_chromo_from_previous(uid) != None:
-            exists = True
-        return exists
+        '''
+            Returns True if either generation holds the uid. This is a
+            membership probe of the uid tables; unlike the getters it
+            never touches the stored chromosomes themselves.
+        '''
+        return uid in self.current \
+                or (self.previous != None and uid in self.previous)
 
     def set_fitness(self, uid, fitness):
         '''
@@ -374,7 +581,7 @@ class Population(object):
         '''
         chromo = self.current[uid]
         chromo.trace = trace
-        self.current[uid] = chromo
+        self.current.update_chromosome(uid, chromo)
         self.current.trace.update(trace)
 
     def elitism(self):
@@ -395,51 +602,61 @@ class Population(object):
         # for each chromosome in the current generation
         for chromo in self.current.get_all():
 
+            # the leaders are kept as (fitness, total, chromosome)
+            # entries, so the per-bbl decision below is one tuple
+            # comparison: fitness decides, the trace total breaks
+            # ties, and on a full tie the incumbent stays. The
+            # challenger's entry is built once per chromosome instead
+            # of calling back into the chromosome per basic block.
+            chromo_fitness = chromo.get_fitness()
+            chromo_total = chromo.trace.get_total()
+            candidate = (chromo_fitness, chromo_total, chromo)
+
+            ###     since we do not keep the number of times each
+            ###     bbl was hit, we compare the total number of
+            ###     basic blocks between the leader and the
+            ###     challenger chromosome. Enabling full trace
+            ###     logging did not seem worth for this feature,
+            ###     due to the memory issues we already have.
+
             # for each image in the monitored
-            for image_name in chromo.trace.set_per_image.iterkeys():
-
-                # for each basic block explored in the run
-                for bbl in chromo.trace.set_per_image[image_name]:
-
-                    # if there isn't any leader for this bbl
-                    # set the current chromo
-                    if self.image_leaders[image_name][bbl] == None:
-                        self.image_leaders[image_name][bbl] = chromo
-                    else:
-                        # pick the fittest chromosome for this specific bbl
-                        leader = self.image_leaders[image_name][bbl]
-
-                        # if the fitness of the currect chromosome is better
-                        # than the fitness of the leader, replace it
-                        if leader.get_fitness() < chromo.get_fitness():
-                            self.image_leaders[image_name][bbl] = chromo
-
-                        ###     since we do not keep the number of times each
-                        ###     bbl was hit, we compare the total number of
-                        ###     basic blocks between the leader and the
-                        ###     challenger chromosome. Enabling full trace
-                        ###     logging did not seem worth for this feature,
-                        ###     due to the memory issues we already have.
-
-                        elif leader.get_fitness() == chromo.get_fitness():
-                            if leader.trace.get_total() \
-                                    < chromo.trace.get_total():
-                                self.image_leaders[image_name][bbl] = chromo
+            for image_name, bbls in chromo.trace.set_per_image.iteritems():
+                bbl_leaders = self.image_leaders[image_name]
+
+                # blocks that have no leader yet are claimed with one
+                # bulk update; only the contested ones are left for
+                # the compare loop below. Both set operations run at
+                # C level over the trace set and the table's key view.
+                contested = bbls & bbl_leaders.viewkeys()
+                if len(contested) != len(bbls):
+                    bbl_leaders.update(
+                            dict.fromkeys(bbls - contested, candidate)
+                            )
+
+                # for each contested basic block explored in the run
+                for bbl in contested:
+                    leader = bbl_leaders[bbl]
+                    if leader[0] < chromo_fitness \
+                            or (leader[0] == chromo_fitness
+                                    and leader[1] < chromo_total):
+                        bbl_leaders[bbl] = candidate
 
         # find the unique chromosome that compose bbl leaders
         elite_chromosomes = {}
 
-        # build the elite generation
+        # build the elite generation; the sparse tables only ever
+        # hold real leader entries
         for bbl_leaders in self.image_leaders.itervalues():
-            for chromo in bbl_leaders.itervalues():
-                if chromo != None:
-                    elite_chromosomes[chromo.uid] = chromo
+            for leader in bbl_leaders.itervalues():
+                chromo = leader[2]
+                elite_chromosomes[chromo.uid] = chromo
 
         # create new generation
         new = self.new_epoch()
         new.extend(elite_chromosomes)
 
-        # set up the generation metrics/stats
-        for chromo in new.get_all():
-            new.trace.update(chromo.trace)
-            new.set_metrics(chromo.uid, chromo.metrics)
+        # set up the generation metrics/stats; the pass only reads the
+        # traces and the metrics, so the light views are enough
+        for light in new.iter_light():
+            new.trace.update(light.trace)
+            new.set_metrics(light.uid, light.metrics)